@@ -9,7 +9,7 @@ from sqlalchemy import select
 from app import models
 from app.models import User
 from database import get_db
-from app.config import SECRET_KEY, ALGORITHM  # из .env через config.py
+from app.config import SECRET_KEY, ALGORITHM, ADMIN_EMAILS  # из .env через config.py
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -87,3 +87,10 @@ async def get_current_user(
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
 
     return user
+
+
+async def get_admin_user(user: models.User = Depends(get_current_user)) -> models.User:
+    """Вернуть текущего пользователя, если он администратор (ADMIN_EMAILS), иначе 403"""
+    if user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return user
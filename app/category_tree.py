@@ -0,0 +1,40 @@
+"""
+Пересборка таблицы замыкания category_closure по catigories.parent_id.
+
+Нужна один раз после добавления иерархии (существующие категории становятся
+корнями) и при ручной правке parent_id в базе.
+
+    python -m app.category_tree
+"""
+import asyncio
+
+from sqlalchemy import text
+
+from database import engine
+
+REBUILD_SQL = """
+INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+    SELECT id, id, 0 FROM catigories
+    UNION ALL
+    SELECT tree.ancestor_id, c.id, tree.depth + 1
+    FROM tree JOIN catigories c ON c.parent_id = tree.descendant_id
+)
+SELECT ancestor_id, descendant_id, depth FROM tree
+"""
+
+
+async def rebuild_closure() -> int:
+    async with engine.begin() as conn:
+        await conn.execute(text("DELETE FROM category_closure"))
+        result = await conn.execute(text(REBUILD_SQL))
+        return result.rowcount
+
+
+if __name__ == "__main__":
+    async def main():
+        count = await rebuild_closure()
+        print(f"Записей в category_closure: {count}")
+        await engine.dispose()
+
+    asyncio.run(main())
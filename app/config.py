@@ -6,3 +6,90 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY", "default_secret_key")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 60))
+
+# Лимиты запросов в формате "<кол-во>/<секунды>"
+RATE_LIMIT_LOGIN = os.getenv("RATE_LIMIT_LOGIN", "10/60")
+RATE_LIMIT_LOGIN_EMAIL = os.getenv("RATE_LIMIT_LOGIN_EMAIL", "5/60")
+RATE_LIMIT_REGISTER = os.getenv("RATE_LIMIT_REGISTER", "5/300")
+# Колбэки PayKeeper: лимит на адрес и поверх него — на один заказ. Адреса PayKeeper
+# (через запятую) шлют колбэки на все заказы сразу, поэтому лимит на адрес к ним не применяется
+RATE_LIMIT_PAYMENT_CALLBACK = os.getenv("RATE_LIMIT_PAYMENT_CALLBACK", "300/60")
+RATE_LIMIT_PAYMENT_CALLBACK_ORDER = os.getenv("RATE_LIMIT_PAYMENT_CALLBACK_ORDER", "10/60")
+PAYKEEPER_CALLBACK_IPS = {ip.strip() for ip in os.getenv("PAYKEEPER_CALLBACK_IPS", "").split(",") if ip.strip()}
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100_000))
+# Общий бэкенд для нескольких воркеров (нужен пакет redis), например redis://localhost:6379/0
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL")
+
+# Фоновые задачи
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1.0))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", 10))
+# Задача в статусе running дольше этого времени считается брошенной и забирается снова
+JOB_TIMEOUT_SECONDS = int(os.getenv("JOB_TIMEOUT_SECONDS", 600))
+# Сколько дней хранить выполненные (done) и окончательно упавшие (dead) задачи
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", 7))
+JOB_DEAD_RETENTION_DAYS = float(os.getenv("JOB_DEAD_RETENTION_DAYS", 30))
+
+# Почта для чеков
+SMTP_HOST = os.getenv("SMTP_HOST")
+SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
+SMTP_USER = os.getenv("SMTP_USER")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_FROM = os.getenv("SMTP_FROM", "shop@localhost")
+
+# Секционирование и архив заказов
+ORDER_PARTITIONS_AHEAD = int(os.getenv("ORDER_PARTITIONS_AHEAD", 3))
+ORDER_ARCHIVE_AFTER_DAYS = int(os.getenv("ORDER_ARCHIVE_AFTER_DAYS", 365))
+
+# Медиа
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", "media")
+PRODUCTS_MEDIA_DIR = os.getenv("PRODUCTS_MEDIA_DIR", os.path.join(MEDIA_ROOT, "products"))
+
+# Товарные фиды (YML для Яндекс.Маркета и CSV)
+FEEDS_DIR = os.getenv("FEEDS_DIR", os.path.join(MEDIA_ROOT, "feeds"))
+# Кэш готовых офферов для инкрементальной пересборки — вне MEDIA_ROOT, наружу не раздаётся
+FEEDS_CACHE_DIR = os.getenv("FEEDS_CACHE_DIR", "feeds_cache")
+FEED_SHOP_NAME = os.getenv("FEED_SHOP_NAME", "Floreks")
+FEED_SHOP_COMPANY = os.getenv("FEED_SHOP_COMPANY", "Floreks")
+FEED_SHOP_URL = os.getenv("FEED_SHOP_URL", os.getenv("FRONTEND_URL", "http://localhost:3000"))
+# Шаблон ссылки на карточку товара и адрес, с которого отдаются картинки (/media/...)
+FEED_PRODUCT_URL = os.getenv("FEED_PRODUCT_URL", FEED_SHOP_URL + "/product/{id}")
+FEED_MEDIA_BASE_URL = os.getenv("FEED_MEDIA_BASE_URL", "http://localhost:8000")
+FEED_CURRENCY = os.getenv("FEED_CURRENCY", "RUR")
+# Перегенерация откладывается, чтобы серия правок товаров дала одну сборку
+FEED_DEBOUNCE_SECONDS = float(os.getenv("FEED_DEBOUNCE_SECONDS", 60))
+
+# Фасеты каталога: границы ценовых диапазонов и время жизни кэша
+PRICE_FACET_BOUNDS = [int(bound) for bound in os.getenv("PRICE_FACET_BOUNDS", "1000,3000,5000,10000").split(",")]
+FACET_CACHE_TTL = float(os.getenv("FACET_CACHE_TTL", 60))
+
+# Подсказки по названиям товаров (индекс в памяти каждого воркера)
+SUGGEST_LIMIT = int(os.getenv("SUGGEST_LIMIT", 10))
+# Полная пересборка подтягивает изменения, сделанные другими воркерами
+SUGGEST_REBUILD_INTERVAL = float(os.getenv("SUGGEST_REBUILD_INTERVAL", 300))
+
+# Сборщик осиротевших файлов в PRODUCTS_MEDIA_DIR
+MEDIA_GC_INTERVAL = float(os.getenv("MEDIA_GC_INTERVAL", 6 * 60 * 60))
+# Файлы моложе этого возраста не трогаем: загрузка может ещё не закоммититься
+MEDIA_GC_GRACE_SECONDS = float(os.getenv("MEDIA_GC_GRACE_SECONDS", 24 * 60 * 60))
+MEDIA_GC_BATCH_SIZE = int(os.getenv("MEDIA_GC_BATCH_SIZE", 1000))
+MEDIA_GC_MAX_FILES_PER_SECOND = float(os.getenv("MEDIA_GC_MAX_FILES_PER_SECOND", 500))
+# Файлов за один запуск задачи: при 500 файлах/с это ~200 с, меньше JOB_TIMEOUT_SECONDS
+MEDIA_GC_FILES_PER_RUN = int(os.getenv("MEDIA_GC_FILES_PER_RUN", 100_000))
+# quarantine — переносить в MEDIA_GC_QUARANTINE_DIR (и удалять оттуда после grace period), delete — удалять сразу
+MEDIA_GC_MODE = os.getenv("MEDIA_GC_MODE", "quarantine")
+# Вне MEDIA_ROOT, чтобы карантин не раздавался через /media; может лежать на другом томе
+MEDIA_GC_QUARANTINE_DIR = os.getenv("MEDIA_GC_QUARANTINE_DIR", "media_quarantine")
+
+# Администраторы (доступ к отчётам профилировщика), через запятую
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
+
+# Профилирование запросов: по подписанному заголовку PROFILE_HEADER или доле случайных запросов
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Profile")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.005))
+# Отчёты лежат в каталоге кольцевым буфером: старые удаляются сверх PROFILE_MAX_REPORTS
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_REPORTS = int(os.getenv("PROFILE_MAX_REPORTS", 200))
+PROFILE_MAX_STATEMENTS = int(os.getenv("PROFILE_MAX_STATEMENTS", 500))
@@ -1,18 +1,27 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import delete
+from sqlalchemy import delete, insert, update, values, column, case, func, literal, tuple_, union_all, String, Integer
 from sqlalchemy.orm import selectinload
-from fastapi import Request, HTTPException
+from fastapi import Depends, Request, HTTPException
 from app.auth_crud import get_current_user
 from sqlalchemy.exc import IntegrityError
+from database import get_db
 
 
-from typing import Optional, List, cast
+from typing import Optional, List, Dict, cast
+from datetime import datetime
 
-from app.models import Order, OrderItem, Product, Category
+from app.models import Order, OrderItem, Product, Category, CategoryClosure
 from app import schemas, models
+from app.jobs import enqueue_unique
+from app.feeds import schedule_regeneration as schedule_feeds
+from app.search_index import product_names
+from app.media_gc import remove_media_files, unreferenced_urls
+from app.order_snapshots import SNAPSHOT_BATCH_SIZE, build_order_snapshot, load_orders, refresh_order_snapshots
+from app.config import PRICE_FACET_BOUNDS, FACET_CACHE_TTL
 import httpx
 import os
+import time
 
 PAYKEEPER_URL = os.getenv("PAYKEEPER_URL", "https://demo.paykeeper.ru/create/")
 SUCCESS_URL = os.getenv("PAYKEEPER_SUCCESS_URL", "http://localhost:5173/checkout/success")
@@ -40,17 +49,34 @@ async def create_payment(order_id: int, amount: float, client_email: str, client
 
 
 # --- USER CRUD ---
-async def get_current_user_optional(request: Request) -> Optional[models.User]:
+async def get_current_user_optional(request: Request, db: AsyncSession = Depends(get_db)) -> Optional[models.User]:
     try:
-        return await get_current_user(request)
+        return await get_current_user(request, db)
     except HTTPException:
         return None
 
 # --- CATEGORY CRUD ---
 
 async def create_category(db: AsyncSession, category: schemas.CategoryCreate):
+    if category.parent_id is not None and await db.get(Category, category.parent_id) is None:
+        raise HTTPException(status_code=404, detail="Родительская категория не найдена")
+
     new_cat = Category(**category.dict())
     db.add(new_cat)
+    await db.flush()
+
+    # Замыкание: предки родителя становятся предками новой категории, плюс она сама
+    await db.execute(
+        insert(CategoryClosure).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            union_all(
+                select(CategoryClosure.ancestor_id, literal(new_cat.id), CategoryClosure.depth + 1)
+                .where(CategoryClosure.descendant_id == category.parent_id),
+                select(literal(new_cat.id), literal(new_cat.id), literal(0)),
+            ),
+        )
+    )
+    await schedule_feeds(db)
     await db.commit()
     await db.refresh(new_cat)
     return new_cat
@@ -59,14 +85,50 @@ async def get_categories(db: AsyncSession):
     result = await db.execute(select(Category))
     return list(result.scalars().all())
 
+async def get_category_tree(db: AsyncSession) -> List[dict]:
+    """Всё дерево категорий с числом товаров в каждом поддереве — одним запросом"""
+    result = await db.execute(
+        select(Category.id, Category.name, Category.tittle, Category.parent_id, func.count(Product.id))
+        .outerjoin(CategoryClosure, CategoryClosure.ancestor_id == Category.id)
+        .outerjoin(Product, Product.catigory == CategoryClosure.descendant_id)
+        .group_by(Category.id)
+        .order_by(Category.id)
+    )
+
+    nodes = {
+        category_id: {
+            "id": category_id, "name": name, "tittle": tittle, "parent_id": parent_id,
+            "product_count": count, "children": [],
+        }
+        for category_id, name, tittle, parent_id, count in result.all()
+    }
+    roots = []
+    for node in nodes.values():
+        parent = nodes.get(node["parent_id"])
+        (parent["children"] if parent else roots).append(node)
+    return roots
+
+async def get_category_breadcrumbs(db: AsyncSession, category_id: int):
+    """Путь от корня до категории"""
+    result = await db.execute(
+        select(Category)
+        .join(CategoryClosure, CategoryClosure.ancestor_id == Category.id)
+        .where(CategoryClosure.descendant_id == category_id)
+        .order_by(CategoryClosure.depth.desc())
+    )
+    return list(result.scalars().all())
+
 # --- PRODUCT CRUD ---
 
 async def create_product(db: AsyncSession, product: schemas.ProductCreate):
     new_product = Product(**product.model_dump())
     db.add(new_product)
     try:
+        await schedule_feeds(db)
         await db.commit()
+        invalidate_product_caches()
         await db.refresh(new_product)
+        product_names.upsert(new_product.id, new_product.name, new_product.available)
         return new_product
     except IntegrityError as e:
         await db.rollback()
@@ -78,17 +140,118 @@ async def create_product(db: AsyncSession, product: schemas.ProductCreate):
             )
         raise
 
-async def get_products(db: AsyncSession):
-    result = await db.execute(select(Product))
+def _product_filters(
+    stmt,
+    catigory: Optional[int] = None,
+    available: Optional[bool] = None,
+    min_price: Optional[int] = None,
+    max_price: Optional[int] = None,
+):
+    if catigory is not None:
+        # Категория вместе со всеми подкатегориями
+        stmt = stmt.where(Product.catigory.in_(
+            select(CategoryClosure.descendant_id).where(CategoryClosure.ancestor_id == catigory)
+        ))
+    if available is not None:
+        stmt = stmt.where(Product.available == available)
+    if min_price is not None:
+        stmt = stmt.where(Product.price >= min_price)
+    if max_price is not None:
+        stmt = stmt.where(Product.price <= max_price)
+    return stmt
+
+
+async def get_products(db: AsyncSession, **filters):
+    result = await db.execute(_product_filters(select(Product), **filters))
     return list(result.scalars().all())
 
+
+# Кэш фасетов: ключ — набор фильтров. Любое изменение товаров увеличивает версию,
+# и старые записи перестают совпадать; TTL покрывает изменения из других воркеров.
+_facets_cache: dict = {}
+_products_version = 0
+
+
+def invalidate_product_caches():
+    global _products_version
+    _products_version += 1
+    _facets_cache.clear()
+
+
+async def get_product_facets(db: AsyncSession, **filters) -> dict:
+    key = tuple(sorted(filters.items()))
+    cached = _facets_cache.get(key)
+    if cached and cached[0] == _products_version and cached[1] > time.monotonic():
+        return cached[2]
+
+    version = _products_version
+    price_bucket = case(
+        *[(Product.price < bound, index) for index, bound in enumerate(PRICE_FACET_BOUNDS)],
+        else_=len(PRICE_FACET_BOUNDS),
+    )
+    filtered = _product_filters(
+        select(Product.catigory, Product.available, price_bucket.label("bucket")), **filters
+    ).subquery()
+
+    # Одна выборка: счётчики по категории, наличию, ценовому диапазону и общий итог
+    result = await db.execute(
+        select(
+            filtered.c.catigory,
+            filtered.c.available,
+            filtered.c.bucket,
+            func.grouping(filtered.c.catigory, filtered.c.available, filtered.c.bucket),
+            func.count(),
+        ).group_by(func.grouping_sets(
+            tuple_(filtered.c.catigory),
+            tuple_(filtered.c.available),
+            tuple_(filtered.c.bucket),
+            tuple_(),
+        ))
+    )
+
+    bounds = [None, *PRICE_FACET_BOUNDS, None]
+    facets = {"total": 0, "categories": [], "available": [], "price_ranges": []}
+    for catigory, available, bucket, grouping, count in result.all():
+        # grouping — битовая маска столбцов, не участвующих в группировке
+        if grouping == 0b011:
+            facets["categories"].append({"id": catigory, "count": count})
+        elif grouping == 0b101:
+            facets["available"].append({"available": available, "count": count})
+        elif grouping == 0b110:
+            facets["price_ranges"].append({"min": bounds[bucket], "max": bounds[bucket + 1], "count": count})
+        else:
+            facets["total"] = count
+
+    facets["categories"].sort(key=lambda f: (f["id"] is None, f["id"]))
+    facets["price_ranges"].sort(key=lambda f: (f["min"] is not None, f["min"]))
+
+    if len(_facets_cache) > 1024:
+        _facets_cache.clear()
+    _facets_cache[key] = (version, time.monotonic() + FACET_CACHE_TTL, facets)
+    return facets
+
+async def touch_product(db: AsyncSession, product_id: int):
+    """Отмечает товар изменённым (например, поменялись картинки) — его оффер в фидах пересоберётся"""
+    await db.execute(update(Product).where(Product.id == product_id).values(updated_at=func.now()))
+
 async def get_product(db: AsyncSession, product_id: int):
     result = await db.execute(select(Product).where(Product.id == product_id))
     return result.scalar_one_or_none()
 
 async def delete_product(db: AsyncSession, product_id: int):
+    # Строки product_images удалит каскад — забираем их файлы заранее
+    result = await db.execute(
+        select(models.ProductImage.image_url).where(models.ProductImage.product_id == product_id)
+    )
+    urls = list(result.scalars().all())
+    # products.image_url — произвольная строка от клиента: такие файлы оставляем сборщику (app/media_gc.py)
     await db.execute(delete(Product).where(Product.id == product_id))
+    await schedule_feeds(db)
     await db.commit()
+    invalidate_product_caches()
+    product_names.remove(product_id)
+    # Файлы удаляем только после успешного коммита и если на них больше никто не ссылается
+    remove_media_files(await unreferenced_urls(db, urls))
 
 async def update_product(db: AsyncSession, product_id: int, updates: dict):
     result = await db.execute(select(Product).where(Product.id == product_id))
@@ -100,8 +263,11 @@ async def update_product(db: AsyncSession, product_id: int, updates: dict):
         setattr(product, key, value)
 
     try:
+        await schedule_feeds(db)
         await db.commit()
+        invalidate_product_caches()
         await db.refresh(product)
+        product_names.upsert(product.id, product.name, product.available)
         return product
     except IntegrityError as e:
         await db.rollback()
@@ -116,21 +282,88 @@ async def update_product(db: AsyncSession, product_id: int, updates: dict):
 
 # --- ORDER CRUD ---
 
+async def _reserve_stock(db: AsyncSession, deltas: Dict[str, int], oversell: bool = False) -> Dict[str, tuple]:
+    """
+    Одним UPDATE ... FROM (VALUES ...) списывает (delta > 0) или возвращает (delta < 0)
+    остатки товаров. Возвращает {название: (amount, available)} после изменения.
+    С oversell=True остаток может уйти в минус, а ненайденные товары пропускаются без 409.
+    """
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return {}
+
+    d = values(column("name", String), column("delta", Integer), name="d").data(list(deltas.items()))
+    stmt = update(Product).where(Product.name == d.c.name)
+    if not oversell:
+        stmt = stmt.where(Product.amount >= d.c.delta)
+    result = await db.execute(
+        stmt
+        # updated_at — чтобы инкрементальная сборка фидов пересобрала оффер
+        .values(amount=Product.amount - d.c.delta, updated_at=func.now())
+        .returning(Product.name, Product.amount, Product.available)
+        .execution_options(synchronize_session=False)
+    )
+    stock = {name: (amount, available) for name, amount, available in result.all()}
+
+    missing = [name for name in deltas if name not in stock]
+    if missing and not oversell:
+        await db.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail=f"Недостаточно товара на складе или товар не найден: {', '.join(missing)}"
+        )
+
+    # Товар закончился или снова появился — available в фидах устарел
+    if any((amount + deltas[name] > 0) != available for name, (amount, available) in stock.items()):
+        await schedule_feeds(db)
+    return stock
+
+
+async def _order_quantities(db: AsyncSession, order_id: int) -> Dict[str, int]:
+    result = await db.execute(
+        select(OrderItem.product_name, func.sum(OrderItem.quantity))
+        .where(OrderItem.order_id == order_id)
+        .group_by(OrderItem.product_name)
+    )
+    return {name: int(quantity) for name, quantity in result.all()}
+
+
+async def release_order_stock(db: AsyncSession, order_id: int):
+    """Возвращает на склад товары заказа (отмена, удаление). Коммит остаётся за вызывающим кодом"""
+    quantities = await _order_quantities(db, order_id)
+    await _reserve_stock(db, {name: -quantity for name, quantity in quantities.items()})
+
+
+async def reserve_order_stock(db: AsyncSession, order_id: int, oversell: bool = False) -> List[str]:
+    """
+    Снова списывает товары отменённого заказа (409, если их уже не хватает). С oversell=True
+    списывает и в минус; возвращает товары, которых не хватило или которых больше нет.
+    """
+    quantities = await _order_quantities(db, order_id)
+    stock = await _reserve_stock(db, quantities, oversell)
+    return [name for name, quantity in quantities.items() if quantity and (name not in stock or stock[name][0] < 0)]
+
+
 async def create_order(db: AsyncSession, order_data: schemas.OrderCreate):
+    deltas: Dict[str, int] = {}
+    for item in order_data.items:
+        deltas[item.product_name] = deltas.get(item.product_name, 0) + item.quantity
+    await _reserve_stock(db, deltas)
+
     order = models.Order(user_id=order_data.user_id, status=order_data.status or models.OrderStatus.new)
     db.add(order)
     await db.flush()
 
-    for item in order_data.items:
+    # Повторы одного товара сливаются в одну позицию — как и в update_order
+    for product_name, quantity in deltas.items():
         db.add(models.OrderItem(
             order_id=order.id,
-            product_name=item.product_name,
-            quantity=item.quantity
+            order_created_at=order.created_at,
+            product_name=product_name,
+            quantity=quantity
         ))
 
-    await db.commit()
-
-    # Теперь достаём заказ с подгруженными связями
+    # Достаём заказ с подгруженными связями и сохраняем снимок в той же транзакции
     result = await db.execute(
         select(models.Order)
         .options(
@@ -139,45 +372,213 @@ async def create_order(db: AsyncSession, order_data: schemas.OrderCreate):
         )
         .where(models.Order.id == order.id)
     )
-    return result.scalar_one()
+    order = result.scalar_one()
+    order.snapshot = build_order_snapshot(order)
+    await db.commit()
+    # Остатки меняют available — фасеты по наличию устарели
+    invalidate_product_caches()
+    return order.snapshot
+
+
+async def _read_snapshots(db: AsyncSession, stmt) -> List[dict]:
+    """
+    Читает снимки заказов. Недостающие (старые заказы) собираются пачками; если их
+    немного — сохраняются сразу, иначе сохранение уходит в фоновую задачу.
+    """
+    rows = (await db.execute(stmt)).all()
+    missing = [order_id for order_id, snapshot in rows if snapshot is None]
+    if not missing:
+        return [snapshot for _, snapshot in rows]
+
+    if len(missing) <= SNAPSHOT_BATCH_SIZE:
+        rebuilt = {snap["id"]: snap for snap in await refresh_order_snapshots(db, missing)}
+        await db.commit()
+    else:
+        rebuilt = {}
+        for start in range(0, len(missing), SNAPSHOT_BATCH_SIZE):
+            for order in await load_orders(db, missing[start:start + SNAPSHOT_BATCH_SIZE]):
+                rebuilt[order.id] = build_order_snapshot(order)
+            db.expunge_all()
+        await enqueue_unique(db, "rebuild_missing_snapshots")
+        await db.commit()
+    return [snapshot if snapshot is not None else rebuilt[order_id] for order_id, snapshot in rows]
+
+
+def _created_between(stmt, model, created_from: Optional[datetime], created_to: Optional[datetime]):
+    """Фильтр по дате создания — по нему Postgres отсекает лишние секции orders"""
+    if created_from is not None:
+        stmt = stmt.where(model.created_at >= created_from)
+    if created_to is not None:
+        stmt = stmt.where(model.created_at < created_to)
+    return stmt
+
+
+async def _with_archive(db: AsyncSession, snapshots: List[dict], archive_stmt) -> List[dict]:
+    """Добавляет закрытые заказы из orders_archive, чтобы история не пропадала после архивации"""
+    archived = (await db.execute(archive_stmt.where(models.OrderArchive.snapshot.isnot(None)))).scalars().all()
+    if not archived:
+        return snapshots
+    return sorted([*archived, *snapshots], key=lambda snapshot: snapshot["id"])
 
 
 # Все заказы
-async def get_all_orders(db: AsyncSession):
-    result = await db.execute(
-        select(models.Order)
-        .options(
-            selectinload(models.Order.items).selectinload(models.OrderItem.product)
-        )
+async def get_all_orders(
+    db: AsyncSession,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+):
+    stmt = select(models.Order.id, models.Order.snapshot).order_by(models.Order.id)
+    snapshots = await _read_snapshots(db, _created_between(stmt, models.Order, created_from, created_to))
+    archive_stmt = select(models.OrderArchive.snapshot)
+    return await _with_archive(
+        db, snapshots, _created_between(archive_stmt, models.OrderArchive, created_from, created_to)
     )
-    return result.scalars().unique().all()
 
 
 # Заказы пользователя
-async def get_orders_by_user(db: AsyncSession, user_id: int):
-    result = await db.execute(
-        select(models.Order)
-        .options(
-            selectinload(models.Order.items).selectinload(models.OrderItem.product)
-        )
+async def get_orders_by_user(
+    db: AsyncSession,
+    user_id: int,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+):
+    stmt = (
+        select(models.Order.id, models.Order.snapshot)
         .where(models.Order.user_id == user_id)
+        .order_by(models.Order.id)
+    )
+    snapshots = await _read_snapshots(db, _created_between(stmt, models.Order, created_from, created_to))
+    archive_stmt = select(models.OrderArchive.snapshot).where(models.OrderArchive.user_id == user_id)
+    return await _with_archive(
+        db, snapshots, _created_between(archive_stmt, models.OrderArchive, created_from, created_to)
     )
-    return result.scalars().unique().all()
 
 
 # Обновление заказа
 async def update_order(db: AsyncSession, order_id: int, order_data: schemas.OrderUpdate):
-    result = await db.execute(select(models.Order).where(models.Order.id == order_id))
+    result = await db.execute(
+        select(models.Order)
+        .options(selectinload(models.Order.items).selectinload(models.OrderItem.product))
+        .where(models.Order.id == order_id)
+        .with_for_update(of=models.Order)
+    )
     order = result.scalar_one_or_none()
     if not order:
         return None
 
-    for key, value in order_data.dict(exclude_unset=True).items():
-        setattr(order, key, value)
-
+    was_cancelled = order.status == models.OrderStatus.cancelled
+    if order_data.status is not None:
+        order.status = order_data.status
+    is_cancelled = order.status == models.OrderStatus.cancelled
+
+    current: Dict[str, int] = {}
+    for item in order.items:
+        current[item.product_name] = current.get(item.product_name, 0) + item.quantity
+    if order_data.order_items is None:
+        requested = current
+    else:
+        requested = {}
+        for item in order_data.order_items:
+            requested[item.product_name] = requested.get(item.product_name, 0) + item.quantity
+        requested = {name: quantity for name, quantity in requested.items() if quantity > 0}
+
+    # Отменённый заказ не держит остатки: считаем, сколько было занято до правки и сколько после
+    held_before = {} if was_cancelled else current
+    held_after = {} if is_cancelled else requested
+    stock = await _reserve_stock(db, {
+        name: held_after.get(name, 0) - held_before.get(name, 0)
+        for name in held_before.keys() | held_after.keys()
+    })
+
+    if order_data.order_items is None:
+        items = [(item.id, item.product_name, item.quantity, item.product) for item in order.items]
+    else:
+        items = await _apply_order_items_diff(db, order, requested)
+
+    # Товар в снимке — на момент заказа: у прежних позиций берём его из старого снимка
+    ordered = {item["product_name"]: item["product"] for item in (order.snapshot or {}).get("items", [])}
+
+    # Снимок собираем из уже известных данных, без повторного чтения заказа
+    order.snapshot = schemas.OrderRead(
+        id=order.id,
+        user_id=order.user_id,
+        created_at=order.created_at,
+        status=order.status,
+        items=[
+            schemas.OrderItemRead(
+                id=item_id,
+                product_name=name,
+                quantity=quantity,
+                product=ordered.get(name) or (schemas.OrderProductRead.model_validate(product) if product else None),
+            )
+            for item_id, name, quantity, product in sorted(items, key=lambda i: i[0])
+        ],
+    ).model_dump(mode="json")
     await db.commit()
-    await db.refresh(order)
-    return order
+    if stock:
+        invalidate_product_caches()
+    return order.snapshot
+
+
+async def _apply_order_items_diff(
+    db: AsyncSession, order: models.Order, requested: Dict[str, int]
+) -> List[tuple]:
+    """
+    Приводит позиции заказа к requested ({название: количество}): не больше одного INSERT,
+    одного UPDATE и одного DELETE. Остатки меняет вызывающий код. Возвращает итоговые
+    позиции в виде (id, product_name, quantity, product).
+    """
+    # В старых заказах один товар может лежать в нескольких строках: оставляем первую, остальные удаляем
+    rows: Dict[str, List[models.OrderItem]] = {}
+    for item in sorted(order.items, key=lambda i: i.id):
+        rows.setdefault(item.product_name, []).append(item)
+    current = {name: items[0] for name, items in rows.items()}
+
+    to_insert = [name for name in requested if name not in current]
+    to_update = [
+        {"id": item.id, "quantity": requested[name]}
+        for name, item in current.items()
+        if name in requested and requested[name] != item.quantity
+    ]
+    to_delete = [
+        item.id
+        for name, items in rows.items()
+        for item in (items if name not in requested else items[1:])
+    ]
+
+    products = {name: item.product for name, item in current.items()}
+    item_ids = {name: item.id for name, item in current.items()}
+
+    if to_insert:
+        result = await db.execute(select(Product).where(Product.name.in_(to_insert)))
+        products.update({product.name: product for product in result.scalars().all()})
+
+        result = await db.execute(
+            insert(OrderItem)
+            .values([
+                {
+                    "order_id": order.id,
+                    "order_created_at": order.created_at,
+                    "product_name": name,
+                    "quantity": requested[name],
+                }
+                for name in to_insert
+            ])
+            .returning(OrderItem.id, OrderItem.product_name)
+        )
+        item_ids.update({name: item_id for item_id, name in result.all()})
+
+    if to_update:
+        await db.execute(update(OrderItem), to_update)
+
+    if to_delete:
+        await db.execute(
+            delete(OrderItem)
+            .where(OrderItem.id.in_(to_delete))
+            .execution_options(synchronize_session=False)
+        )
+
+    return [(item_ids[name], name, quantity, products.get(name)) for name, quantity in requested.items()]
 
 
 # Удаление заказа
@@ -187,14 +588,23 @@ async def delete_order(db: AsyncSession, order_id: int):
     if not order:
         return False
 
+    if order.status != models.OrderStatus.cancelled:
+        await release_order_stock(db, order.id)
     await db.delete(order)
     await db.commit()
+    invalidate_product_caches()
     return True
 
 #Заказ по id
 async def get_order_by_id(db: AsyncSession, order_id: int):
-    stmt = select(Order).where(Order.id == order_id)
-    result = await db.execute(stmt)
+    snapshots = await _read_snapshots(db, select(Order.id, Order.snapshot).where(Order.id == order_id))
+    if snapshots:
+        return snapshots[0]
+
+    # Закрытые старые заказы лежат в архиве
+    result = await db.execute(
+        select(models.OrderArchive.snapshot).where(models.OrderArchive.id == order_id)
+    )
     return result.scalar_one_or_none()
 
 
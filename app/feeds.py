@@ -0,0 +1,299 @@
+"""
+Товарные фиды для маркетплейсов и агрегаторов: YML (Яндекс.Маркет) и CSV.
+
+Фиды пишутся во временные файлы (mkstemp), которые затем атомарно подменяют
+старые — краулер всегда видит целый файл. Готовые фиды отдаются статикой:
+/media/feeds/yml.xml и /media/feeds/products.csv.
+
+Пересборка инкрементальная: в FEEDS_CACHE_DIR лежит кэш готовых офферов (offers.cache.jsonl)
+с отметкой времени прошлой сборки. Заново рендерятся только товары с
+products.updated_at новее отметки, остальные офферы берутся из кэша, удалённые
+товары выпадают при слиянии со списком текущих id. Без кэша, с --full или при
+большом числе изменений фиды собираются целиком потоком через серверный курсор.
+Запуски сериализуются advisory-блокировкой Postgres — и между воркерами, и между процессами.
+
+После изменения товаров или категорий ставится отложенная задача regenerate_feeds
+(см. schedule_regeneration), серия правок даёт одну пересборку.
+
+    python -m app.feeds [--full]
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import tempfile
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+from xml.sax.saxutils import escape, quoteattr
+
+from sqlalchemy import func, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.config import (
+    FEEDS_CACHE_DIR,
+    FEEDS_DIR,
+    FEED_CURRENCY,
+    FEED_DEBOUNCE_SECONDS,
+    FEED_MEDIA_BASE_URL,
+    FEED_PRODUCT_URL,
+    FEED_SHOP_COMPANY,
+    FEED_SHOP_NAME,
+    FEED_SHOP_URL,
+)
+from app.jobs import enqueue_unique, job_handler
+from app.models import Category, Product, ProductImage
+from database import AsyncSessionLocal
+
+YML_PATH = os.path.join(FEEDS_DIR, "yml.xml")
+CSV_PATH = os.path.join(FEEDS_DIR, "products.csv")
+CACHE_PATH = os.path.join(FEEDS_CACHE_DIR, "offers.cache.jsonl")
+CSV_COLUMNS = ["id", "name", "category_id", "category", "price", "currency", "available", "url", "picture", "description"]
+BATCH_SIZE = 1000
+# Ключ pg_advisory_xact_lock для пересборки фидов
+FEEDS_LOCK_KEY = 0x0F1EED
+# Транзакция, начатая до прошлой сборки, могла закоммитить товар позже неё
+WATERMARK_OVERLAP = timedelta(minutes=5)
+# При большем числе изменённых товаров дешевле собрать фиды целиком
+INCREMENTAL_LIMIT = 50_000
+
+
+def _offers_query():
+    first_image = (
+        select(ProductImage.image_url)
+        .where(ProductImage.product_id == Product.id)
+        .order_by(ProductImage.id)
+        .limit(1)
+        .correlate(Product)
+        .scalar_subquery()
+    )
+    return (
+        select(
+            Product.id,
+            Product.name,
+            Product.catigory,
+            Product.price,
+            Product.available,
+            Product.description,
+            func.coalesce(first_image, Product.image_url).label("picture"),
+        )
+        .order_by(Product.id)
+        .execution_options(yield_per=BATCH_SIZE)
+    )
+
+
+def _picture_url(path):
+    if not path:
+        return None
+    return path if path.startswith("http") else FEED_MEDIA_BASE_URL + path
+
+
+def _render_offer(row) -> str:
+    parts = [
+        f'<offer id="{row.id}" available="{"true" if row.available else "false"}">',
+        f"<name>{escape(row.name)}</name>",
+        f"<url>{escape(FEED_PRODUCT_URL.format(id=row.id))}</url>",
+        f"<price>{row.price or 0}</price>",
+        f"<currencyId>{FEED_CURRENCY}</currencyId>",
+    ]
+    if row.catigory is not None:
+        parts.append(f"<categoryId>{row.catigory}</categoryId>")
+    picture = _picture_url(row.picture)
+    if picture:
+        parts.append(f"<picture>{escape(picture)}</picture>")
+    if row.description:
+        parts.append(f"<description>{escape(row.description)}</description>")
+    parts.append("</offer>\n")
+    return "".join(parts)
+
+
+def _offer_entry(row) -> dict:
+    """Запись кэша: готовый оффер YML и строка CSV без названия категории (оно может поменяться)"""
+    return {
+        "id": row.id,
+        "yml": _render_offer(row),
+        "csv": [
+            row.id,
+            row.name,
+            row.catigory,
+            row.price or 0,
+            "true" if row.available else "false",
+            FEED_PRODUCT_URL.format(id=row.id),
+            _picture_url(row.picture),
+            row.description,
+        ],
+    }
+
+
+def _csv_row(entry: dict, categories: dict) -> list:
+    product_id, name, category_id, price, available, url, picture, description = entry["csv"]
+    return [product_id, name, category_id, categories.get(category_id), price, FEED_CURRENCY, available, url, picture, description]
+
+
+def _read_cache_watermark():
+    try:
+        with open(CACHE_PATH, encoding="utf-8") as f:
+            header = json.loads(f.readline())
+        return datetime.fromisoformat(header["generated_at"])
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+
+
+def _cached_entries():
+    """Записи кэша по возрастанию id"""
+    with open(CACHE_PATH, encoding="utf-8") as f:
+        f.readline()
+        for line in f:
+            yield json.loads(line)
+
+
+async def _full_entries(db: AsyncSession):
+    result = await db.stream(_offers_query())
+    async for rows in result.partitions():
+        for row in rows:
+            yield _offer_entry(row)
+
+
+async def _render_products(db: AsyncSession, product_ids) -> dict:
+    rendered = {}
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), BATCH_SIZE):
+        result = await db.execute(_offers_query().where(Product.id.in_(product_ids[start:start + BATCH_SIZE])))
+        rendered.update((row.id, _offer_entry(row)) for row in result.all())
+    return rendered
+
+
+async def _incremental_entries(db: AsyncSession, changed_ids: list):
+    """Слияние текущих id с кэшем: изменённые и отсутствующие в кэше рендерятся заново"""
+    product_ids = (await db.execute(select(Product.id).order_by(Product.id))).scalars().all()
+    fresh = await _render_products(db, changed_ids)
+
+    cached = _cached_entries()
+    current = next(cached, None)
+    for product_id in product_ids:
+        entry = fresh.get(product_id)
+        if entry is None:
+            while current is not None and current["id"] < product_id:
+                current = next(cached, None)
+            if current is not None and current["id"] == product_id:
+                entry = current
+            else:
+                entry = (await _render_products(db, [product_id])).get(product_id)
+        if entry is not None:
+            yield entry
+
+
+def _remove_if_exists(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _temp_file(stack: ExitStack, path: str, **kwargs):
+    """Временный файл с уникальным именем рядом с path; удаляется, если не дошло до os.replace"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp")
+    stack.callback(_remove_if_exists, tmp_path)
+    # mkstemp создаёт файл 0600, а фиды раздаются статикой
+    os.chmod(tmp_path, 0o644)
+    return stack.enter_context(os.fdopen(fd, "w", encoding="utf-8", **kwargs)), tmp_path
+
+
+async def generate_feeds(db: AsyncSession, full: bool = False) -> str:
+    """Собирает фиды; возвращает режим сборки ("full" или "incremental")"""
+    os.makedirs(FEEDS_DIR, exist_ok=True)
+    os.makedirs(FEEDS_CACHE_DIR, exist_ok=True)
+    # Вторая сборка ждёт первую и потом идёт от её кэша
+    await db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": FEEDS_LOCK_KEY})
+    # localtimestamp — в том же виде, что и products.updated_at (TIMESTAMP без зоны)
+    generated_at = (await db.execute(select(func.localtimestamp()))).scalar()
+
+    watermark = None if full else _read_cache_watermark()
+    changed_ids = None
+    if watermark is not None:
+        result = await db.execute(
+            select(Product.id)
+            .where(Product.updated_at >= watermark - WATERMARK_OVERLAP)
+            .order_by(Product.id)
+            .limit(INCREMENTAL_LIMIT + 1)
+        )
+        changed_ids = result.scalars().all()
+        if len(changed_ids) > INCREMENTAL_LIMIT:
+            changed_ids = None
+
+    categories = (await db.execute(
+        select(Category.id, Category.tittle, Category.name, Category.parent_id)
+    )).all()
+    category_titles = {category_id: tittle for category_id, tittle, _, _ in categories}
+    entries = _full_entries(db) if changed_ids is None else _incremental_entries(db, changed_ids)
+
+    with ExitStack() as stack:
+        yml, yml_tmp = _temp_file(stack, YML_PATH)
+        csv_file, csv_tmp = _temp_file(stack, CSV_PATH, newline="")
+        cache, cache_tmp = _temp_file(stack, CACHE_PATH)
+
+        yml.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        yml.write(f'<yml_catalog date="{datetime.now():%Y-%m-%dT%H:%M:%S}">\n<shop>\n')
+        yml.write(f"<name>{escape(FEED_SHOP_NAME)}</name>\n")
+        yml.write(f"<company>{escape(FEED_SHOP_COMPANY)}</company>\n")
+        yml.write(f"<url>{escape(FEED_SHOP_URL)}</url>\n")
+        yml.write(f'<currencies><currency id={quoteattr(FEED_CURRENCY)} rate="1"/></currencies>\n')
+        yml.write("<categories>\n")
+        for category_id, tittle, name, parent_id in categories:
+            parent = f' parentId="{parent_id}"' if parent_id is not None else ""
+            yml.write(f'<category id="{category_id}"{parent}>{escape(tittle or name)}</category>\n')
+        yml.write("</categories>\n<offers>\n")
+
+        writer = csv.writer(csv_file)
+        writer.writerow(CSV_COLUMNS)
+        cache.write(json.dumps({"generated_at": generated_at.isoformat()}) + "\n")
+
+        async for entry in entries:
+            yml.write(entry["yml"])
+            writer.writerow(_csv_row(entry, category_titles))
+            cache.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+        yml.write("</offers>\n</shop>\n</yml_catalog>\n")
+        for f in (yml, csv_file, cache):
+            f.close()
+
+        os.replace(yml_tmp, YML_PATH)
+        os.replace(csv_tmp, CSV_PATH)
+        # Кэш — последним: если упадём раньше, следующая сборка повторит те же изменения
+        os.replace(cache_tmp, CACHE_PATH)
+
+    return "full" if changed_ids is None else "incremental"
+
+
+async def schedule_regeneration(db: AsyncSession):
+    """Вызывается в транзакции, изменившей товары или категории"""
+    await enqueue_unique(db, "regenerate_feeds", delay=FEED_DEBOUNCE_SECONDS)
+
+
+async def schedule_if_missing():
+    """При старте: собрать фиды, если их ещё нет на диске"""
+    if os.path.exists(YML_PATH) and os.path.exists(CSV_PATH):
+        return
+    async with AsyncSessionLocal() as db:
+        await enqueue_unique(db, "regenerate_feeds")
+        await db.commit()
+
+
+@job_handler("regenerate_feeds")
+async def regenerate_feeds(db: AsyncSession, payload: dict):
+    await generate_feeds(db)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сборка товарных фидов")
+    parser.add_argument("--full", action="store_true", help="собрать целиком, не используя кэш офферов")
+    args = parser.parse_args()
+
+    async def main():
+        async with AsyncSessionLocal() as db:
+            mode = await generate_feeds(db, full=args.full)
+            await db.commit()
+        print(f"Фиды записаны ({mode}): {YML_PATH}, {CSV_PATH}")
+
+    asyncio.run(main())
@@ -0,0 +1,281 @@
+"""
+Очередь фоновых задач на Postgres.
+
+Задача ставится в ту же транзакцию, что и бизнес-изменение:
+
+    enqueue(db, "send_receipt", {"order_id": order.id})
+    await db.commit()
+
+Воркеры запускаются в lifespan приложения и забирают задачи через
+SELECT ... FOR UPDATE SKIP LOCKED, так что несколько процессов не мешают друг другу.
+Упавшая задача повторяется с экспоненциальной задержкой, после JOB_MAX_ATTEMPTS
+попыток переводится в статус dead. Выполненные и dead-задачи удаляет
+ежедневная задача purge_jobs (JOB_RETENTION_DAYS / JOB_DEAD_RETENTION_DAYS).
+"""
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import (
+    JOB_DEAD_RETENTION_DAYS,
+    JOB_MAX_ATTEMPTS,
+    JOB_POLL_INTERVAL,
+    JOB_RETENTION_DAYS,
+    JOB_RETRY_BASE_SECONDS,
+    JOB_TIMEOUT_SECONDS,
+    JOB_WORKERS,
+)
+from app.models import Job, JobStatus
+from database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[AsyncSession, dict], Awaitable[None]]
+HANDLERS: Dict[str, Handler] = {}
+
+# Для периодических задач, которые сами ставят следующий запуск: выполняющаяся
+# задача тоже считается, иначе при каждом старте появлялась бы вторая цепочка
+ACTIVE_JOB_STATUSES = (JobStatus.pending.value, JobStatus.running.value)
+
+
+def job_handler(kind: str):
+    """Регистрирует обработчик задач указанного типа"""
+    def decorator(func: Handler) -> Handler:
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(
+    db: AsyncSession,
+    kind: str,
+    payload: Optional[dict] = None,
+    delay: float = 0,
+    max_attempts: int = JOB_MAX_ATTEMPTS,
+) -> Job:
+    """Добавляет задачу в текущую сессию. Коммит остаётся за вызывающим кодом"""
+    job = Job(kind=kind, payload=payload or {}, max_attempts=max_attempts)
+    if delay:
+        job.run_at = func.now() + timedelta(seconds=delay)
+    db.add(job)
+    return job
+
+
+async def enqueue_unique(
+    db: AsyncSession,
+    kind: str,
+    payload: Optional[dict] = None,
+    delay: float = 0,
+    statuses: tuple = (JobStatus.pending.value,),
+):
+    """Ставит задачу, только если такая же ещё ждёт в очереди — серия изменений даёт один запуск"""
+    result = await db.execute(
+        select(Job.id)
+        .where(Job.kind == kind, Job.status.in_(statuses))
+        .limit(1)
+    )
+    if result.scalar_one_or_none() is None:
+        enqueue(db, kind, payload, delay)
+
+
+# --- Метрики ---
+
+class JobMetrics:
+    """Счётчики и задержки по типам задач в пределах процесса"""
+
+    def __init__(self):
+        self.kinds: Dict[str, dict] = {}
+
+    def record(self, kind: str, waited: float, duration: float, ok: bool):
+        stats = self.kinds.setdefault(kind, {
+            "processed": 0, "failed": 0,
+            "wait_total": 0.0, "wait_max": 0.0,
+            "run_total": 0.0, "run_max": 0.0,
+        })
+        stats["processed"] += 1
+        if not ok:
+            stats["failed"] += 1
+        stats["wait_total"] += waited
+        stats["wait_max"] = max(stats["wait_max"], waited)
+        stats["run_total"] += duration
+        stats["run_max"] = max(stats["run_max"], duration)
+
+    def snapshot(self) -> Dict[str, dict]:
+        result = {}
+        for kind, stats in self.kinds.items():
+            count = stats["processed"] or 1
+            result[kind] = {
+                "processed": stats["processed"],
+                "failed": stats["failed"],
+                "wait_avg": stats["wait_total"] / count,
+                "wait_max": stats["wait_max"],
+                "run_avg": stats["run_total"] / count,
+                "run_max": stats["run_max"],
+            }
+        return result
+
+
+metrics = JobMetrics()
+
+
+async def get_queue_stats(db: AsyncSession) -> dict:
+    """Глубина очереди по статусам и возраст самой старой готовой задачи"""
+    result = await db.execute(
+        select(Job.status, func.count(), func.extract("epoch", func.now() - func.min(Job.run_at)))
+        .where(Job.status != JobStatus.done.value)
+        .group_by(Job.status)
+    )
+    depth = {status.value: 0 for status in JobStatus if status != JobStatus.done}
+    oldest = None
+    for status, count, age in result.all():
+        depth[status] = count
+        if status == JobStatus.pending.value and age is not None:
+            oldest = max(float(age), 0.0)
+
+    return {"depth": depth, "oldest_pending_seconds": oldest, "jobs": metrics.snapshot()}
+
+
+# --- Очистка ---
+
+PURGE_BATCH_SIZE = 10_000
+
+
+async def purge_finished(db: AsyncSession) -> int:
+    """Удаляет старые done/dead задачи пачками, чтобы не держать долгие блокировки"""
+    purged = 0
+    for status, days in ((JobStatus.done, JOB_RETENTION_DAYS), (JobStatus.dead, JOB_DEAD_RETENTION_DAYS)):
+        while True:
+            batch = (
+                select(Job.id)
+                .where(Job.status == status.value, Job.finished_at < func.now() - timedelta(days=days))
+                .limit(PURGE_BATCH_SIZE)
+                .scalar_subquery()
+            )
+            result = await db.execute(delete(Job).where(Job.id.in_(batch)))
+            await db.commit()
+            purged += result.rowcount
+            if result.rowcount < PURGE_BATCH_SIZE:
+                break
+    return purged
+
+
+@job_handler("purge_jobs")
+async def purge_jobs(db: AsyncSession, payload: dict):
+    purged = await purge_finished(db)
+    logger.info("Удалено старых задач: %s", purged)
+    enqueue(db, "purge_jobs", delay=24 * 60 * 60)
+
+
+async def schedule_purge():
+    async with AsyncSessionLocal() as db:
+        await enqueue_unique(db, "purge_jobs", statuses=ACTIVE_JOB_STATUSES)
+        await db.commit()
+
+
+# --- Воркеры ---
+
+async def _claim(db: AsyncSession):
+    """Забирает одну готовую задачу (или брошенную упавшим воркером)"""
+    candidate = (
+        select(Job.id)
+        .where(or_(
+            and_(Job.status == JobStatus.pending.value, Job.run_at <= func.now()),
+            and_(
+                Job.status == JobStatus.running.value,
+                Job.started_at < func.now() - timedelta(seconds=JOB_TIMEOUT_SECONDS),
+            ),
+        ))
+        .order_by(Job.run_at)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    result = await db.execute(
+        update(Job)
+        .where(Job.id == candidate)
+        .values(status=JobStatus.running.value, attempts=Job.attempts + 1, started_at=func.now())
+        .returning(
+            Job.id, Job.kind, Job.payload, Job.attempts, Job.max_attempts,
+            func.extract("epoch", func.now() - Job.run_at).label("waited"),
+        )
+    )
+    row = result.first()
+    await db.commit()
+    return row
+
+
+async def _fail(job_id: int, attempts: int, max_attempts: int, error: str):
+    async with AsyncSessionLocal() as db:
+        if attempts >= max_attempts:
+            values = {"status": JobStatus.dead.value, "finished_at": func.now()}
+        else:
+            delay = JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+            values = {"status": JobStatus.pending.value, "run_at": func.now() + timedelta(seconds=delay)}
+        await db.execute(update(Job).where(Job.id == job_id).values(last_error=error[:2000], **values))
+        await db.commit()
+
+
+async def run_once() -> bool:
+    """Выполняет одну задачу. Возвращает False, если очередь пуста"""
+    async with AsyncSessionLocal() as db:
+        job = await _claim(db)
+        if job is None:
+            return False
+
+        started = time.perf_counter()
+        handler = HANDLERS.get(job.kind)
+        try:
+            if handler is None:
+                raise LookupError(f"Нет обработчика для задачи '{job.kind}'")
+            await handler(db, job.payload)
+            # Отметка о выполнении коммитится вместе с изменениями обработчика
+            await db.execute(
+                update(Job)
+                .where(Job.id == job.id)
+                .values(status=JobStatus.done.value, finished_at=func.now(), last_error=None)
+            )
+            await db.commit()
+            ok = True
+        except Exception as e:
+            await db.rollback()
+            logger.exception("Задача %s (%s) завершилась ошибкой", job.id, job.kind)
+            await _fail(job.id, job.attempts, job.max_attempts, repr(e))
+            ok = False
+
+    metrics.record(job.kind, float(job.waited or 0), time.perf_counter() - started, ok)
+    return True
+
+
+async def worker(stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            if await run_once():
+                continue
+        except Exception:
+            logger.exception("Ошибка воркера фоновых задач")
+
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=JOB_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+_stop = asyncio.Event()
+_workers: List[asyncio.Task] = []
+
+
+def start_workers(count: int = JOB_WORKERS):
+    _stop.clear()
+    for _ in range(count):
+        _workers.append(asyncio.create_task(worker(_stop)))
+
+
+async def stop_workers():
+    _stop.set()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
@@ -0,0 +1,282 @@
+"""
+Сборщик осиротевших файлов товаров.
+
+Файлы из PRODUCTS_MEDIA_DIR читаются через os.scandir пачками, каждая пачка
+сверяется с product_images.image_url и products.image_url одним anti-join по
+временной таблице. Файлы без ссылок старше MEDIA_GC_GRACE_SECONDS переносятся
+в карантин (или удаляются) уже после коммита, с ограничением скорости по I/O.
+Фоновая задача проходит каталог порциями по MEDIA_GC_FILES_PER_RUN файлов
+в порядке имён, каждая следующая порция — отдельная задача.
+
+Запускается периодической фоновой задачей sweep_media и вручную:
+
+    python -m app.media_gc --dry-run
+    python -m app.media_gc [--delete]
+"""
+import argparse
+import asyncio
+import heapq
+import logging
+import os
+import shutil
+import time
+from typing import Iterator, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import (
+    MEDIA_GC_BATCH_SIZE,
+    MEDIA_GC_FILES_PER_RUN,
+    MEDIA_GC_GRACE_SECONDS,
+    MEDIA_GC_INTERVAL,
+    MEDIA_GC_MAX_FILES_PER_SECOND,
+    MEDIA_GC_MODE,
+    MEDIA_GC_QUARANTINE_DIR,
+    PRODUCTS_MEDIA_DIR,
+)
+from app.jobs import ACTIVE_JOB_STATUSES, enqueue, enqueue_unique, job_handler
+from database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Сколько имён файлов класть в отчёт
+REPORT_SAMPLE = 100
+
+
+def media_url(filename: str) -> str:
+    """URL файла товара в том виде, в каком он хранится в product_images.image_url"""
+    return f"/{PRODUCTS_MEDIA_DIR}/{filename}".replace("\\", "/")
+
+
+def media_path(url: str) -> Optional[str]:
+    """Путь к файлу по URL или None, если URL указывает за пределы PRODUCTS_MEDIA_DIR"""
+    root = os.path.realpath(PRODUCTS_MEDIA_DIR)
+    path = os.path.realpath(os.path.join(os.getcwd(), url.lstrip("/")))
+    if path == root or os.path.commonpath([path, root]) != root:
+        return None
+    return path
+
+
+async def unreferenced_urls(db: AsyncSession, urls: List[str]) -> List[str]:
+    """URL, на которые больше не ссылаются ни product_images, ни products"""
+    if not urls:
+        return []
+    result = await db.execute(
+        text(
+            """SELECT image_url FROM product_images WHERE image_url = ANY(:urls)
+               UNION SELECT image_url FROM products WHERE image_url = ANY(:urls)"""
+        ),
+        {"urls": list(urls)},
+    )
+    referenced = set(result.scalars().all())
+    return [url for url in urls if url not in referenced]
+
+
+def remove_media_files(urls: List[str]):
+    """
+    Удаляет файлы товаров по URL. Вызывать только после коммита удаления строк
+    и проверки unreferenced_urls; файлы вне PRODUCTS_MEDIA_DIR не трогаются.
+    """
+    for url in urls:
+        path = media_path(url)
+        if path is None:
+            logger.warning("Пропущен файл вне %s: %s", PRODUCTS_MEDIA_DIR, url)
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # Оставшийся файл подберёт сборщик
+            logger.exception("Не удалось удалить %s", url)
+
+
+def _scan(directory: str, after: Optional[str]) -> Iterator[os.DirEntry]:
+    """Файлы с именами после after. Тип берётся из readdir, stat здесь не вызывается"""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if after is not None and entry.name <= after:
+                continue
+            if entry.is_file(follow_symlinks=False):
+                yield entry
+
+
+def _scan_batches(
+    directory: str, batch_size: int, after: Optional[str] = None, limit: Optional[int] = None
+) -> Iterator[List[os.DirEntry]]:
+    """
+    Пачки файлов. С limit — не больше limit файлов с именами после after в порядке имён,
+    чтобы следующий запуск продолжил с последнего имени. Порция выбирается только по
+    именам: stat вызывает sweep для файлов пачки, под ограничением скорости.
+    """
+    entries = _scan(directory, after)
+    if limit is not None:
+        entries = iter(heapq.nsmallest(limit, entries, key=lambda entry: entry.name))
+
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def _find_orphans(db: AsyncSession, urls: List[str]) -> set:
+    await db.execute(text(
+        "CREATE TEMP TABLE IF NOT EXISTS media_gc_files (url TEXT PRIMARY KEY) ON COMMIT DELETE ROWS"
+    ))
+    await db.execute(text("INSERT INTO media_gc_files (url) VALUES (:url)"), [{"url": url} for url in urls])
+    result = await db.execute(text(
+        """SELECT f.url FROM media_gc_files f
+           WHERE NOT EXISTS (SELECT 1 FROM product_images i WHERE i.image_url = f.url)
+             AND NOT EXISTS (SELECT 1 FROM products p WHERE p.image_url = f.url)"""
+    ))
+    orphans = set(result.scalars().all())
+    await db.commit()
+    return orphans
+
+
+def _purge_quarantine(min_age: float) -> int:
+    if not os.path.isdir(MEDIA_GC_QUARANTINE_DIR):
+        return 0
+    cutoff = time.time() - min_age
+    purged = 0
+    with os.scandir(MEDIA_GC_QUARANTINE_DIR) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False) and entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                os.remove(entry.path)
+                purged += 1
+    return purged
+
+
+async def sweep(
+    db: AsyncSession,
+    dry_run: bool = False,
+    mode: str = MEDIA_GC_MODE,
+    grace_seconds: float = MEDIA_GC_GRACE_SECONDS,
+    batch_size: int = MEDIA_GC_BATCH_SIZE,
+    max_files_per_second: float = MEDIA_GC_MAX_FILES_PER_SECOND,
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+) -> dict:
+    """
+    Проходит файлы товаров. С limit обрабатывает одну порцию после имени after;
+    report["next_after"] — имя, с которого продолжать, или None, если проход завершён.
+    """
+    report = {
+        "dry_run": dry_run, "mode": mode, "scanned": 0, "orphans": 0, "bytes": 0, "purged": 0,
+        "sample": [], "next_after": None,
+    }
+    if not os.path.isdir(PRODUCTS_MEDIA_DIR):
+        return report
+    if mode == "quarantine" and not dry_run:
+        os.makedirs(MEDIA_GC_QUARANTINE_DIR, exist_ok=True)
+
+    cutoff = time.time() - grace_seconds
+    last_name = None
+    for batch in _scan_batches(PRODUCTS_MEDIA_DIR, batch_size, after, limit):
+        started = time.monotonic()
+        last_name = batch[-1].name
+        report["scanned"] += len(batch)
+
+        # Свежие файлы пропускаем: строка с их URL может быть ещё не закоммичена
+        urls = {}
+        for entry in batch:
+            try:
+                stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime <= cutoff:
+                urls[media_url(entry.name)] = (entry, stat)
+        orphans = await _find_orphans(db, list(urls)) if urls else set()
+
+        for url in orphans:
+            entry, stat = urls[url]
+            report["orphans"] += 1
+            report["bytes"] += stat.st_size
+            if len(report["sample"]) < REPORT_SAMPLE:
+                report["sample"].append(url)
+            if dry_run:
+                continue
+
+            try:
+                if mode == "delete":
+                    os.remove(entry.path)
+                else:
+                    target = os.path.join(MEDIA_GC_QUARANTINE_DIR, entry.name)
+                    # shutil.move копирует, если карантин на другой файловой системе (EXDEV у os.replace)
+                    shutil.move(entry.path, target)
+                    # mtime отсчитывает срок хранения в карантине
+                    os.utime(target)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # Один проблемный файл не должен останавливать весь проход
+                logger.exception("Не удалось убрать %s", url)
+
+        # Не больше max_files_per_second файлов в секунду, чтобы не забивать диск
+        budget = len(batch) / max_files_per_second
+        elapsed = time.monotonic() - started
+        if budget > elapsed:
+            await asyncio.sleep(budget - elapsed)
+
+    if limit is not None and report["scanned"] >= limit:
+        report["next_after"] = last_name
+        return report
+
+    if mode == "quarantine" and not dry_run:
+        report["purged"] = _purge_quarantine(grace_seconds)
+    return report
+
+
+@job_handler("sweep_media")
+async def sweep_media(db: AsyncSession, payload: dict):
+    """
+    Одна порция прохода (MEDIA_GC_FILES_PER_RUN файлов): с ограничением скорости она
+    укладывается в JOB_TIMEOUT_SECONDS, и задачу не заберёт второй воркер.
+    Продолжение ставится сразу, следующий проход — через MEDIA_GC_INTERVAL.
+    """
+    report = await sweep(db, after=payload.get("after"), limit=MEDIA_GC_FILES_PER_RUN)
+    logger.info(
+        "Сборщик медиа: просмотрено %s, без ссылок %s (%s байт), удалено из карантина %s",
+        report["scanned"], report["orphans"], report["bytes"], report["purged"],
+    )
+    if report["next_after"] is not None:
+        enqueue(db, "sweep_media", {"after": report["next_after"]})
+    else:
+        enqueue(db, "sweep_media", delay=MEDIA_GC_INTERVAL)
+
+
+async def schedule_sweeper():
+    if MEDIA_GC_INTERVAL <= 0:
+        return
+    async with AsyncSessionLocal() as db:
+        await enqueue_unique(db, "sweep_media", statuses=ACTIVE_JOB_STATUSES)
+        await db.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сборщик осиротевших файлов товаров")
+    parser.add_argument("--dry-run", action="store_true", help="только отчёт, файлы не трогать")
+    parser.add_argument("--delete", action="store_true", help="удалять сразу, без карантина")
+    parser.add_argument("--grace-seconds", type=float, default=MEDIA_GC_GRACE_SECONDS)
+    args = parser.parse_args()
+
+    async def main():
+        async with AsyncSessionLocal() as db:
+            report = await sweep(
+                db,
+                dry_run=args.dry_run,
+                mode="delete" if args.delete else MEDIA_GC_MODE,
+                grace_seconds=args.grace_seconds,
+            )
+        for key, value in report.items():
+            if key != "sample":
+                print(f"{key}: {value}")
+        for url in report["sample"]:
+            print(f"  {url}")
+
+    asyncio.run(main())
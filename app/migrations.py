@@ -0,0 +1,92 @@
+"""
+Изменения схемы БД для существующей базы. Все шаги идемпотентны, их можно
+запускать повторно и после каждого обновления кода:
+
+    python -m app.migrations          # 1. таблицы и колонки (до запуска приложения)
+    python -m app.partitioning setup  # 2. по желанию: секционирование orders / order_items
+
+Без первого шага приложение не стартует: lifespan ставит задачи в таблицу jobs.
+"""
+import asyncio
+
+from sqlalchemy import text
+
+from app.category_tree import REBUILD_SQL
+from app.partitioning import ARCHIVE_STATEMENTS
+from database import engine
+
+STEPS = [
+    ("фоновые задачи (jobs)", [
+        """CREATE TABLE IF NOT EXISTS jobs (
+               id SERIAL PRIMARY KEY,
+               kind VARCHAR(100) NOT NULL,
+               payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+               status VARCHAR(20) NOT NULL DEFAULT 'pending',
+               attempts INTEGER NOT NULL DEFAULT 0,
+               max_attempts INTEGER NOT NULL,
+               last_error VARCHAR,
+               created_at TIMESTAMP NOT NULL DEFAULT now(),
+               run_at TIMESTAMP NOT NULL DEFAULT now(),
+               started_at TIMESTAMP,
+               finished_at TIMESTAMP
+           )""",
+        "CREATE INDEX IF NOT EXISTS ix_jobs_claim ON jobs (run_at) WHERE status IN ('pending', 'running')",
+        "CREATE INDEX IF NOT EXISTS ix_jobs_active_kind ON jobs (kind) WHERE status IN ('pending', 'running')",
+        # Снимки больше не пересобираются при правке товара — у таких задач нет обработчика
+        "DELETE FROM jobs WHERE kind = 'refresh_product_orders' AND status = 'pending'",
+    ]),
+    ("снимки заказов (orders.snapshot)", [
+        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS snapshot JSONB",
+        "UPDATE orders SET created_at = now() WHERE created_at IS NULL",
+        "ALTER TABLE orders ALTER COLUMN created_at SET NOT NULL",
+        "CREATE INDEX IF NOT EXISTS ix_orders_user_id ON orders (user_id)",
+    ]),
+    ("дата заказа в позициях (order_items.order_created_at)", [
+        "ALTER TABLE order_items ADD COLUMN IF NOT EXISTS order_created_at TIMESTAMP",
+        """UPDATE order_items i SET order_created_at = o.created_at
+           FROM orders o WHERE o.id = i.order_id AND i.order_created_at IS NULL""",
+        # Позиции без заказа
+        "UPDATE order_items SET order_created_at = now() WHERE order_created_at IS NULL",
+        "ALTER TABLE order_items ALTER COLUMN order_created_at SET NOT NULL",
+    ]),
+    # LIKE копирует колонки — шаг идёт после snapshot и order_created_at
+    ("архив заказов (orders_archive, order_items_archive)", ARCHIVE_STATEMENTS),
+    ("дерево категорий (catigories.parent_id, category_closure)", [
+        "ALTER TABLE catigories ADD COLUMN IF NOT EXISTS parent_id INTEGER REFERENCES catigories (id)",
+        "CREATE INDEX IF NOT EXISTS ix_catigories_parent_id ON catigories (parent_id)",
+        """CREATE TABLE IF NOT EXISTS category_closure (
+               ancestor_id INTEGER NOT NULL REFERENCES catigories (id) ON DELETE CASCADE,
+               descendant_id INTEGER NOT NULL REFERENCES catigories (id) ON DELETE CASCADE,
+               depth INTEGER NOT NULL,
+               PRIMARY KEY (ancestor_id, descendant_id)
+           )""",
+        "CREATE INDEX IF NOT EXISTS ix_category_closure_descendant ON category_closure (descendant_id, depth)",
+        # Первое заполнение: существующие категории становятся корнями
+        f"""{REBUILD_SQL.strip()}
+            WHERE NOT EXISTS (SELECT 1 FROM category_closure)""",
+    ]),
+    ("время изменения товаров (products.updated_at)", [
+        "ALTER TABLE products ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT now()",
+        "CREATE INDEX IF NOT EXISTS ix_products_updated_at ON products (updated_at)",
+    ]),
+    ("индексы картинок товаров", [
+        "CREATE INDEX IF NOT EXISTS ix_product_images_product_id ON product_images (product_id)",
+        "CREATE INDEX IF NOT EXISTS ix_product_images_image_url ON product_images (image_url)",
+    ]),
+]
+
+
+async def migrate():
+    async with engine.begin() as conn:
+        for name, statements in STEPS:
+            for statement in statements:
+                await conn.execute(text(statement))
+            print(f"OK: {name}")
+
+
+if __name__ == "__main__":
+    async def main():
+        await migrate()
+        await engine.dispose()
+
+    asyncio.run(main())
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime, func, Computed, Enum as PgEnum
+from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime, func, Computed, Index, text, Enum as PgEnum
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from database import Base
 import enum
@@ -9,16 +10,30 @@ class Category(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
     tittle = Column(String, nullable=False)
+    parent_id = Column(Integer, ForeignKey("catigories.id"), nullable=True, index=True)
 
     products = relationship("Product", back_populates="category")
 
 
+class CategoryClosure(Base):
+    """Все пары предок-потомок дерева категорий, включая саму категорию (depth = 0)"""
+    __tablename__ = "category_closure"
+
+    ancestor_id = Column(Integer, ForeignKey("catigories.id", ondelete="CASCADE"), primary_key=True)
+    descendant_id = Column(Integer, ForeignKey("catigories.id", ondelete="CASCADE"), primary_key=True)
+    depth = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_category_closure_descendant", "descendant_id", "depth"),
+    )
+
+
 class ProductImage(Base):
     __tablename__ = "product_images"
 
     id = Column(Integer, primary_key=True, index=True)
-    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"))
-    image_url = Column(String, nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), index=True)
+    image_url = Column(String, nullable=False, index=True)
 
     product = relationship("Product", back_populates="images")
 
@@ -34,6 +49,8 @@ class Product(Base):
     available = Column(Boolean, Computed("amount > 0", persisted=True), nullable=False)
     description = Column(String, server_default="Описание отсутсвует")
     image_url = Column(String, nullable=True)
+    # По нему фиды пересобирают только изменённые офферы (app/feeds.py)
+    updated_at = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now(), index=True)
 
     category = relationship("Category", back_populates="products")
     images = relationship(
@@ -62,12 +79,18 @@ class OrderStatus(str, enum.Enum):
     cancelled = "cancelled"
 
 class Order(Base):
+    # Секционирована по created_at помесячно (см. app/partitioning.py),
+    # в БД первичный ключ — (id, created_at), id по-прежнему уникален через sequence
     __tablename__ = "orders"
+    # created_at нужен сразу после INSERT — он же ключ секции для order_items
+    __mapper_args__ = {"eager_defaults": True}
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
-    created_at = Column(DateTime, server_default=func.now())
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
     status = Column(PgEnum(OrderStatus, name="orders_statuses", create_type=False), nullable=False, server_default=OrderStatus.new.value)
+    # Готовый OrderRead заказа: GET-запросы читают только эту колонку (см. app/order_snapshots.py)
+    snapshot = Column(JSONB, nullable=True)
 
     user = relationship(
         "User",
@@ -87,8 +110,51 @@ class OrderItem(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     order_id = Column(Integer, ForeignKey("orders.id"))
+    # Копия orders.created_at — ключ секционирования order_items
+    order_created_at = Column(DateTime, nullable=False)
     product_name = Column(String, ForeignKey("products.name"))
     quantity = Column(Integer, nullable=False)
 
     product = relationship("Product", lazy="selectin")
     order = relationship("Order", back_populates="items")
+
+
+class OrderArchive(Base):
+    """Закрытые заказы, перенесённые из orders командой archive"""
+    __tablename__ = "orders_archive"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=True, index=True)
+    created_at = Column(DateTime, nullable=False)
+    status = Column(PgEnum(OrderStatus, name="orders_statuses", create_type=False), nullable=False)
+    snapshot = Column(JSONB, nullable=True)
+
+
+class JobStatus(str, enum.Enum):
+    pending = "pending"
+    running = "running"
+    done = "done"
+    dead = "dead"
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(100), nullable=False)
+    payload = Column(JSONB, nullable=False, server_default=text("'{}'::jsonb"))
+    status = Column(String(20), nullable=False, server_default=JobStatus.pending.value)
+    attempts = Column(Integer, nullable=False, server_default=text("0"))
+    max_attempts = Column(Integer, nullable=False)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+    run_at = Column(DateTime, nullable=False, server_default=func.now())
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Воркеры выбирают только готовые к запуску задачи
+        Index("ix_jobs_claim", "run_at", postgresql_where=text("status IN ('pending', 'running')")),
+        # enqueue_unique ищет активную задачу того же типа при каждой правке товара
+        Index("ix_jobs_active_kind", "kind", postgresql_where=text("status IN ('pending', 'running')")),
+    )
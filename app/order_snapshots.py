@@ -0,0 +1,108 @@
+"""
+Денормализованная модель чтения заказов.
+
+В orders.snapshot хранится уже собранный OrderRead (с позициями и товарами),
+поэтому чтение заказа — одна строка по индексу вместо orders + users + order_items + products.
+Снимок пишется при создании заказа и при каждом изменении статуса или позиций.
+Товар в позиции — название, цена и картинка на момент заказа (OrderProductRead), без
+остатков, поэтому продажи и правки товара снимки не трогают.
+
+Пересборка всех снимков из нормализованных таблиц:
+
+    python -m app.order_snapshots [--batch-size 500]
+"""
+import argparse
+import asyncio
+from typing import List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import selectinload
+
+from app import models, schemas
+from app.jobs import job_handler
+from database import AsyncSessionLocal
+
+# Сколько заказов пересобирается за одну транзакцию
+SNAPSHOT_BATCH_SIZE = 500
+
+
+def build_order_snapshot(order: models.Order) -> dict:
+    return schemas.OrderRead.model_validate(order).model_dump(mode="json")
+
+
+def set_snapshot_status(order: models.Order):
+    """Смена статуса не требует пересборки — меняем одно поле снимка"""
+    order.snapshot = {**order.snapshot, "status": models.OrderStatus(order.status).value}
+
+
+async def load_orders(db: AsyncSession, order_ids: List[int]) -> List[models.Order]:
+    result = await db.execute(
+        select(models.Order)
+        .options(selectinload(models.Order.items).selectinload(models.OrderItem.product))
+        .where(models.Order.id.in_(order_ids))
+        .order_by(models.Order.id)
+    )
+    return list(result.scalars().unique().all())
+
+
+async def refresh_order_snapshots(db: AsyncSession, order_ids: List[int]) -> List[dict]:
+    """Пересобирает снимки из нормализованных таблиц. Коммит остаётся за вызывающим кодом"""
+    snapshots = []
+    for order in await load_orders(db, order_ids):
+        order.snapshot = build_order_snapshot(order)
+        snapshots.append(order.snapshot)
+    return snapshots
+
+
+async def refresh_order_snapshot(db: AsyncSession, order_id: int) -> Optional[dict]:
+    snapshots = await refresh_order_snapshots(db, [order_id])
+    return snapshots[0] if snapshots else None
+
+
+async def refresh_in_batches(db: AsyncSession, next_ids, batch_size: int = SNAPSHOT_BATCH_SIZE) -> int:
+    """
+    Пересобирает снимки пачками по batch_size с коммитом на пачку: число параметров
+    в IN (...) и размер транзакции не растут с числом заказов. next_ids(last_id)
+    возвращает SELECT id заказов больше last_id по возрастанию.
+    """
+    last_id = 0
+    total = 0
+    while True:
+        result = await db.execute(next_ids(last_id).limit(batch_size))
+        order_ids = list(result.scalars().all())
+        if not order_ids:
+            return total
+
+        await refresh_order_snapshots(db, order_ids)
+        await db.commit()
+        db.expunge_all()
+
+        last_id = order_ids[-1]
+        total += len(order_ids)
+
+
+@job_handler("rebuild_missing_snapshots")
+async def rebuild_missing_snapshots(db: AsyncSession, payload: dict):
+    """Заказы без снимка (созданные до его появления), которые чтение не стало собирать само"""
+    await refresh_in_batches(db, lambda last_id: (
+        select(models.Order.id)
+        .where(models.Order.snapshot.is_(None), models.Order.id > last_id)
+        .order_by(models.Order.id)
+    ))
+
+
+async def rebuild_snapshots(batch_size: int = SNAPSHOT_BATCH_SIZE) -> int:
+    async with AsyncSessionLocal() as db:
+        return await refresh_in_batches(db, lambda last_id: (
+            select(models.Order.id).where(models.Order.id > last_id).order_by(models.Order.id)
+        ), batch_size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Пересборка снимков заказов")
+    parser.add_argument("--batch-size", type=int, default=SNAPSHOT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    count = asyncio.run(rebuild_snapshots(args.batch_size))
+    print(f"Пересобрано снимков: {count}")
@@ -0,0 +1,258 @@
+"""
+Помесячное секционирование orders / order_items и архив закрытых заказов.
+
+    python -m app.partitioning setup                      # один раз, после python -m app.migrations
+    python -m app.partitioning ensure [--ahead 3]         # создать секции на будущие месяцы
+    python -m app.partitioning archive [--older-than-days 365]
+
+orders секционируется по created_at, order_items — по order_created_at (копия даты заказа),
+поэтому позиции заказа лежат в секции того же месяца. id заказов берутся из прежней
+sequence и не меняются, так что колбэки PayKeeper продолжают находить заказы по id.
+Будущие секции создаёт ежедневная фоновая задача ensure_order_partitions.
+"""
+import argparse
+import asyncio
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from app import models
+from app.config import ORDER_ARCHIVE_AFTER_DAYS, ORDER_PARTITIONS_AHEAD
+from app.jobs import ACTIVE_JOB_STATUSES, enqueue, enqueue_unique, job_handler
+from app.order_snapshots import refresh_order_snapshots
+from database import AsyncSessionLocal, engine
+
+CLOSED_STATUSES = (models.OrderStatus.completed.value, models.OrderStatus.cancelled.value)
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+async def is_partitioned(conn: AsyncConnection) -> bool:
+    result = await conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('orders')"))
+    return result.scalar() == "p"
+
+
+async def create_partitions(conn: AsyncConnection, start: date, end: date):
+    """Создаёт секции orders и order_items для месяцев [start, end]"""
+    month = date(start.year, start.month, 1)
+    while month <= end:
+        upper = add_months(month, 1)
+        suffix = f"p{month:%Y%m}"
+        for table in ("orders", "order_items"):
+            await conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {table}_{suffix} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{upper.isoformat()}')"
+            ))
+        month = upper
+
+
+async def ensure_partitions(conn: AsyncConnection, ahead: int = ORDER_PARTITIONS_AHEAD):
+    today = date.today()
+    await create_partitions(conn, today, add_months(today, ahead))
+
+
+ARCHIVE_STATEMENTS = [
+    "CREATE TABLE IF NOT EXISTS orders_archive (LIKE orders INCLUDING DEFAULTS, PRIMARY KEY (id))",
+    "CREATE INDEX IF NOT EXISTS ix_orders_archive_user_id ON orders_archive (user_id)",
+    "CREATE TABLE IF NOT EXISTS order_items_archive (LIKE order_items INCLUDING DEFAULTS, PRIMARY KEY (id))",
+    "CREATE INDEX IF NOT EXISTS ix_order_items_archive_order_id ON order_items_archive (order_id)",
+]
+
+
+async def create_archive_tables(conn: AsyncConnection):
+    for statement in ARCHIVE_STATEMENTS:
+        await conn.execute(text(statement))
+
+
+SETUP_STATEMENTS = [
+    "ALTER TABLE order_items RENAME TO order_items_legacy",
+    "ALTER TABLE orders RENAME TO orders_legacy",
+
+    """CREATE TABLE orders (LIKE orders_legacy INCLUDING DEFAULTS)
+       PARTITION BY RANGE (created_at)""",
+    "ALTER TABLE orders ALTER COLUMN created_at SET NOT NULL",
+    # Старые orders_pkey / ix_* ещё заняты таблицей orders_legacy, поэтому имена свои
+    "ALTER TABLE orders ADD CONSTRAINT orders_part_pkey PRIMARY KEY (id, created_at)",
+    "ALTER TABLE orders ADD FOREIGN KEY (user_id) REFERENCES users (id)",
+
+    # order_created_at уже есть и заполнена (python -m app.migrations)
+    """CREATE TABLE order_items (LIKE order_items_legacy INCLUDING DEFAULTS)
+       PARTITION BY RANGE (order_created_at)""",
+    "ALTER TABLE order_items ADD CONSTRAINT order_items_part_pkey PRIMARY KEY (id, order_created_at)",
+    """ALTER TABLE order_items ADD FOREIGN KEY (order_id, order_created_at)
+       REFERENCES orders (id, created_at) ON DELETE CASCADE""",
+    "ALTER TABLE order_items ADD FOREIGN KEY (product_name) REFERENCES products (name)",
+]
+
+COPY_STATEMENTS = [
+    "UPDATE orders_legacy SET created_at = now() WHERE created_at IS NULL",
+    "INSERT INTO orders SELECT * FROM orders_legacy",
+    "INSERT INTO order_items SELECT * FROM order_items_legacy",
+    "ALTER SEQUENCE orders_id_seq OWNED BY orders.id",
+    "ALTER SEQUENCE order_items_id_seq OWNED BY order_items.id",
+    "DROP TABLE order_items_legacy",
+    "DROP TABLE orders_legacy",
+
+    # Поиск по id (колбэки PayKeeper) — по индексу в каждой секции
+    "CREATE INDEX ix_orders_id ON orders (id)",
+    "CREATE INDEX ix_orders_user_id_created_at ON orders (user_id, created_at)",
+    "CREATE INDEX ix_order_items_order_id ON order_items (order_id)",
+]
+
+
+async def setup():
+    """Переводит существующие orders/order_items на секции в одной транзакции"""
+    async with engine.begin() as conn:
+        if await is_partitioned(conn):
+            print("orders уже секционирована")
+            return
+        result = await conn.execute(text(
+            """SELECT 1 FROM information_schema.columns
+               WHERE table_name = 'order_items' AND column_name = 'order_created_at'"""
+        ))
+        if result.scalar() is None:
+            print("Нет order_items.order_created_at: сначала выполните python -m app.migrations")
+            return
+
+        for statement in SETUP_STATEMENTS:
+            await conn.execute(text(statement))
+
+        result = await conn.execute(text("SELECT coalesce(min(created_at), now())::date FROM orders_legacy"))
+        await create_partitions(conn, result.scalar(), add_months(date.today(), ORDER_PARTITIONS_AHEAD))
+
+        for statement in COPY_STATEMENTS:
+            await conn.execute(text(statement))
+
+        await create_archive_tables(conn)
+
+
+async def archive(older_than_days: int = ORDER_ARCHIVE_AFTER_DAYS, batch_size: int = 1000) -> int:
+    """Переносит completed/cancelled заказы старше older_than_days в архивные таблицы"""
+    cutoff = "now() - make_interval(days => :days)"
+    params = {"statuses": list(CLOSED_STATUSES), "days": older_than_days}
+    moved = 0
+
+    async with AsyncSessionLocal() as db:
+        await create_archive_tables(await db.connection())
+
+        while True:
+            # Батч фиксируем по id; у каждого архивного заказа должен быть снимок
+            result = await db.execute(
+                text(
+                    "SELECT id, snapshot IS NULL FROM orders "
+                    f"WHERE status::text = ANY(:statuses) AND created_at < {cutoff} "
+                    "ORDER BY id LIMIT :limit"
+                ),
+                {**params, "limit": batch_size},
+            )
+            rows = result.all()
+            if not rows:
+                break
+
+            ids = [order_id for order_id, _ in rows]
+            await refresh_order_snapshots(db, [order_id for order_id, missing in rows if missing])
+            await db.flush()
+
+            await db.execute(text(
+                f"""WITH moved AS (
+                        DELETE FROM order_items
+                        WHERE order_id = ANY(:ids) AND order_created_at < {cutoff}
+                        RETURNING *
+                    )
+                    INSERT INTO order_items_archive SELECT * FROM moved"""
+            ), {"ids": ids, "days": older_than_days})
+            await db.execute(text(
+                f"""WITH moved AS (
+                        DELETE FROM orders
+                        WHERE id = ANY(:ids) AND created_at < {cutoff}
+                        RETURNING *
+                    )
+                    INSERT INTO orders_archive SELECT * FROM moved"""
+            ), {"ids": ids, "days": older_than_days})
+            await db.commit()
+            db.expunge_all()
+            moved += len(ids)
+
+        await drop_empty_partitions(await db.connection(), older_than_days)
+        await db.commit()
+
+    return moved
+
+
+async def drop_empty_partitions(conn: AsyncConnection, older_than_days: int):
+    """
+    Удаляет опустевшие после архивации старые секции. Поиск заказа только по id
+    (колбэк PayKeeper) проверяет индекс каждой секции, поэтому их число держим небольшим.
+    """
+    result = await conn.execute(text(
+        """SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+           WHERE i.inhparent = 'orders'::regclass ORDER BY c.relname"""
+    ))
+    cutoff = await conn.execute(
+        text("SELECT date_trunc('month', now() - make_interval(days => :days))::date"),
+        {"days": older_than_days},
+    )
+    cutoff_month = cutoff.scalar()
+
+    for name in result.scalars().all():
+        suffix = name.removeprefix("orders_")
+        month = date(int(suffix[1:5]), int(suffix[5:7]), 1)
+        if month >= cutoff_month:
+            continue
+
+        items = f"order_items_{suffix}"
+        has_rows = await conn.execute(text(
+            f"SELECT EXISTS (SELECT 1 FROM {name}) OR EXISTS (SELECT 1 FROM {items})"
+        ))
+        if has_rows.scalar():
+            continue
+
+        for parent, partition in (("order_items", items), ("orders", name)):
+            await conn.execute(text(f"ALTER TABLE {parent} DETACH PARTITION {partition}"))
+            await conn.execute(text(f"DROP TABLE {partition}"))
+
+
+# --- Фоновое создание секций ---
+
+@job_handler("ensure_order_partitions")
+async def ensure_order_partitions(db: AsyncSession, payload: dict):
+    conn = await db.connection()
+    if await is_partitioned(conn):
+        await ensure_partitions(conn)
+    enqueue(db, "ensure_order_partitions", delay=24 * 60 * 60)
+
+
+async def schedule_maintenance():
+    """Ставит ежедневную задачу создания секций, если её ещё нет в очереди"""
+    async with AsyncSessionLocal() as db:
+        await enqueue_unique(db, "ensure_order_partitions", statuses=ACTIVE_JOB_STATUSES)
+        await db.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Секционирование и архив заказов")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("setup")
+    ensure_parser = commands.add_parser("ensure")
+    ensure_parser.add_argument("--ahead", type=int, default=ORDER_PARTITIONS_AHEAD)
+    archive_parser = commands.add_parser("archive")
+    archive_parser.add_argument("--older-than-days", type=int, default=ORDER_ARCHIVE_AFTER_DAYS)
+    archive_parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    async def main():
+        if args.command == "setup":
+            await setup()
+        elif args.command == "ensure":
+            async with engine.begin() as conn:
+                await ensure_partitions(conn, args.ahead)
+        else:
+            count = await archive(args.older_than_days, args.batch_size)
+            print(f"Перенесено в архив заказов: {count}")
+        await engine.dispose()
+
+    asyncio.run(main())
@@ -0,0 +1,363 @@
+"""
+Профилирование отдельных запросов по требованию.
+
+Запрос профилируется, если в заголовке PROFILE_HEADER пришёл действующий подписанный
+токен (HMAC на SECRET_KEY, см. sign_token) или он попал в долю PROFILE_SAMPLE_RATE.
+Для такого запроса собираются:
+
+  * статистический профиль — отдельный поток раз в PROFILE_INTERVAL снимает стек
+    потока цикла событий (и потока пула для sync-обработчиков) через sys._current_frames();
+    на цикле событий в профиль попадают и конкурентные запросы, а ожидание БД видно как select;
+  * SQL-запросы с длительностью — события движка before/after_cursor_execute;
+  * разбивка времени: разбор тела и зависимости / обработчик / сериализация ответа —
+    метки ставит ProfiledRoute (route_class у всех APIRouter).
+
+Отчёт пишется JSON-файлом в PROFILE_DIR, сверх PROFILE_MAX_REPORTS старые удаляются.
+В ответ добавляется заголовок X-Profile-Id. Без профилирования запрос стоит одного
+просмотра заголовков и одного обращения к contextvar на SQL-запрос.
+
+Токен для заголовка:
+
+    python -m app.profiling --ttl 600
+"""
+import argparse
+import asyncio
+import contextvars
+import functools
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+from app.config import (
+    PROFILE_DIR,
+    PROFILE_HEADER,
+    PROFILE_INTERVAL,
+    PROFILE_MAX_REPORTS,
+    PROFILE_MAX_STATEMENTS,
+    PROFILE_SAMPLE_RATE,
+    SECRET_KEY,
+)
+from database import engine
+
+logger = logging.getLogger(__name__)
+
+REPORT_ID_RE = re.compile(r"^\d{13}-[0-9a-f]{8}$")
+# Сколько строк оставлять в разделах отчёта
+TOP_FUNCTIONS = 30
+TOP_STACKS = 100
+TOP_STATEMENTS = 20
+
+_HEADER = PROFILE_HEADER.lower().encode()
+
+_current: contextvars.ContextVar[Optional["Profile"]] = contextvars.ContextVar("profile", default=None)
+
+
+def sign_token(ttl: int = 600) -> str:
+    """Токен для заголовка PROFILE_HEADER: "<expires>.<hmac>" """
+    expires = str(int(time.time()) + ttl)
+    signature = hmac.new(SECRET_KEY.encode(), expires.encode(), hashlib.sha256).hexdigest()
+    return f"{expires}.{signature}"
+
+
+def verify_token(token: str) -> bool:
+    expires, _, signature = token.partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    expected = hmac.new(SECRET_KEY.encode(), expires.encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def _frame_label(code) -> str:
+    path = code.co_filename.replace("\\", "/").rsplit("/", 2)
+    return f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+
+class Profile:
+    def __init__(self, scope: dict, reason: str):
+        self.id = f"{int(time.time() * 1000):013d}-{secrets.token_hex(4)}"
+        self.reason = reason
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.status = None
+        self.started_at = datetime.now()
+        self.started = time.perf_counter()
+        self.finished = None
+        self.marks = {}
+        self.thread_ids = {threading.get_ident()}
+        self.samples = Counter()
+        self.statements = []
+
+    def mark(self, name: str):
+        self.marks[name] = time.perf_counter()
+
+    def add_sample(self, frame):
+        stack = []
+        while frame is not None:
+            stack.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        self.samples[";".join(reversed(stack))] += 1
+
+    def _phases(self) -> dict:
+        marks = self.marks
+        if not {"route_start", "handler_start", "handler_end", "route_end"} <= marks.keys():
+            return {}
+        return {
+            "dependencies_ms": (marks["handler_start"] - marks["route_start"]) * 1000,
+            "handler_ms": (marks["handler_end"] - marks["handler_start"]) * 1000,
+            "serialization_ms": (marks["route_end"] - marks["handler_end"]) * 1000,
+        }
+
+    def _sql(self) -> dict:
+        by_statement = defaultdict(lambda: [0, 0.0])
+        for statement, duration in self.statements:
+            by_statement[statement][0] += 1
+            by_statement[statement][1] += duration
+        top = sorted(by_statement.items(), key=lambda item: item[1][1], reverse=True)[:TOP_STATEMENTS]
+        return {
+            "count": len(self.statements),
+            "total_ms": sum(duration for _, duration in self.statements) * 1000,
+            "top": [
+                {"statement": statement, "calls": calls, "total_ms": total * 1000}
+                for statement, (calls, total) in top
+            ],
+            "statements": [
+                {"statement": statement, "duration_ms": duration * 1000}
+                for statement, duration in self.statements[:PROFILE_MAX_STATEMENTS]
+            ],
+        }
+
+    def _stacks(self) -> dict:
+        total = sum(self.samples.values())
+        inclusive, own = Counter(), Counter()
+        for stack, count in self.samples.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+
+        def rows(counter):
+            return [
+                {"function": function, "samples": count, "percent": round(100 * count / total, 1)}
+                for function, count in counter.most_common(TOP_FUNCTIONS)
+            ]
+
+        return {
+            "interval_ms": PROFILE_INTERVAL * 1000,
+            "samples": total,
+            "inclusive": rows(inclusive),
+            "self": rows(own),
+            # Формат folded stacks — подходит для flamegraph.pl и speedscope
+            "stacks": [f"{stack} {count}" for stack, count in self.samples.most_common(TOP_STACKS)],
+        }
+
+    def report(self) -> dict:
+        return {
+            "id": self.id,
+            "reason": self.reason,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": ((self.finished or time.perf_counter()) - self.started) * 1000,
+            "phases": self._phases(),
+            "sql": self._sql(),
+            "profile": self._stacks(),
+        }
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, profile: Profile, interval: float):
+        super().__init__(name=f"profiler-{profile.id}", daemon=True)
+        self.profile = profile
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for ident in tuple(self.profile.thread_ids):
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.profile.add_sample(frame)
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        context._profile_started = time.perf_counter()
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current.get()
+    started = getattr(context, "_profile_started", None)
+    if profile is not None and started is not None:
+        profile.statements.append((statement, time.perf_counter() - started))
+
+
+def _timed_endpoint(endpoint):
+    """Обёртка обработчика с метками начала и конца; сигнатура сохраняется для FastAPI"""
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            profile = _current.get()
+            if profile is None:
+                return await endpoint(*args, **kwargs)
+            profile.mark("handler_start")
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                profile.mark("handler_end")
+        return wrapper
+
+    @functools.wraps(endpoint)
+    def sync_wrapper(*args, **kwargs):
+        profile = _current.get()
+        if profile is None:
+            return endpoint(*args, **kwargs)
+        # sync-обработчик выполняется в пуле потоков — сэмплируем и этот поток
+        ident = threading.get_ident()
+        profile.thread_ids.add(ident)
+        profile.mark("handler_start")
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            profile.mark("handler_end")
+            profile.thread_ids.discard(ident)
+    return sync_wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """Маршрут, размечающий зависимости, обработчик и сериализацию для профилировщика"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def profiled_handler(request):
+            profile = _current.get()
+            if profile is None:
+                return await handler(request)
+            profile.mark("route_start")
+            try:
+                return await handler(request)
+            finally:
+                profile.mark("route_end")
+
+        return profiled_handler
+
+
+def _profile_reason(scope: dict) -> Optional[str]:
+    for name, value in scope["headers"]:
+        if name == _HEADER:
+            return "header" if verify_token(value.decode("latin-1")) else None
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return "sample"
+    return None
+
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        reason = _profile_reason(scope) if scope["type"] == "http" else None
+        if reason is None:
+            return await self.app(scope, receive, send)
+
+        profile = Profile(scope, reason)
+        token = _current.set(profile)
+        sampler = _Sampler(profile, PROFILE_INTERVAL)
+        sampler.start()
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile.id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profile.finished = time.perf_counter()
+            sampler.stopped.set()
+            _current.reset(token)
+            try:
+                await asyncio.to_thread(_write_report, sampler, profile)
+            except Exception:
+                logger.exception("Не удалось сохранить отчёт профилировщика %s", profile.id)
+
+
+def _write_report(sampler: _Sampler, profile: Profile):
+    sampler.join()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{profile.id}.json")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(profile.report(), f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+    # Кольцевой буфер: id начинается с времени в мс, поэтому сортировка по имени — по возрасту
+    names = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith(".json"))
+    for name in names[:-PROFILE_MAX_REPORTS]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except FileNotFoundError:
+            pass
+
+
+def load_report(report_id: str) -> Optional[dict]:
+    if not REPORT_ID_RE.match(report_id):
+        return None
+    try:
+        with open(os.path.join(PROFILE_DIR, f"{report_id}.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def list_reports(limit: int = 50) -> List[dict]:
+    """Краткие сведения о последних отчётах, новые первыми"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    names = sorted((name for name in os.listdir(PROFILE_DIR) if name.endswith(".json")), reverse=True)
+    summaries = []
+    for name in names[:limit]:
+        report = load_report(name[:-len(".json")])
+        if report is None:
+            continue
+        summaries.append({
+            "id": report["id"],
+            "reason": report["reason"],
+            "method": report["method"],
+            "path": report["path"],
+            "status": report["status"],
+            "started_at": report["started_at"],
+            "duration_ms": report["duration_ms"],
+            "sql_count": report["sql"]["count"],
+            "sql_ms": report["sql"]["total_ms"],
+        })
+    return summaries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Токен для профилирования запроса")
+    parser.add_argument("--ttl", type=int, default=600, help="срок действия, секунд")
+    args = parser.parse_args()
+    print(f"{PROFILE_HEADER}: {sign_token(args.ttl)}")
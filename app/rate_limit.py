@@ -0,0 +1,154 @@
+import math
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from fastapi import HTTPException, Request
+
+from app.config import RATE_LIMIT_MAX_KEYS, RATE_LIMIT_REDIS_URL
+
+
+def parse_limit(value: str) -> tuple[int, float]:
+    """Разбирает лимит вида "10/60" -> (10 запросов, 60 секунд)"""
+    count, _, period = value.partition("/")
+    return int(count), float(period or 1)
+
+
+class MemoryBackend:
+    """Token bucket в памяти процесса: по одной записи (tokens, ts, expires_at) на активный ключ"""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, tuple[float, float, float]]" = OrderedDict()
+
+    async def hit(self, key: str, capacity: int, period: float) -> float:
+        """Списывает токен; возвращает 0, если запрос разрешён, иначе сколько секунд ждать"""
+        now = time.monotonic()
+        rate = capacity / period
+
+        bucket = self._buckets.pop(key, None)
+        if bucket is None or bucket[2] <= now:
+            tokens = float(capacity)
+        else:
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+
+        if tokens >= 1:
+            tokens -= 1
+            retry_after = 0.0
+        else:
+            retry_after = (1 - tokens) / rate
+
+        # Когда ведро снова наполнится, запись можно выбросить — она равна новой
+        self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+        self._evict(now)
+        return retry_after
+
+    def _evict(self, now: float):
+        # Ключи упорядочены по последнему обращению: чистим с головы пару
+        # протухших записей за вызов, чтобы стоимость оставалась O(1)
+        for _ in range(2):
+            if not self._buckets:
+                return
+            key, bucket = next(iter(self._buckets.items()))
+            if bucket[2] > now:
+                break
+            del self._buckets[key]
+
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+
+class RedisBackend:
+    """Фиксированное окно в Redis — лимиты общие для всех воркеров"""
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis  # опциональная зависимость
+
+        self._redis = redis.from_url(url)
+
+    async def hit(self, key: str, capacity: int, period: float) -> float:
+        now = time.time()
+        window = int(now // period)
+        redis_key = f"rl:{key}:{window}"
+
+        pipe = self._redis.pipeline()
+        pipe.incr(redis_key)
+        pipe.expire(redis_key, math.ceil(period))
+        count, _ = await pipe.execute()
+
+        if count <= capacity:
+            return 0.0
+        return (window + 1) * period - now
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = RedisBackend(RATE_LIMIT_REDIS_URL) if RATE_LIMIT_REDIS_URL else MemoryBackend()
+    return _backend
+
+
+# --- Ключи ---
+
+async def client_ip(request: Request) -> Optional[str]:
+    return request.client.host if request.client else None
+
+
+def client_ip_except(addresses) -> Callable[[Request], Awaitable[Optional[str]]]:
+    """client_ip, но без лимита для доверенных адресов"""
+    async def key(request: Request) -> Optional[str]:
+        ip = await client_ip(request)
+        return None if ip in addresses else ip
+    return key
+
+
+async def body_email(request: Request) -> Optional[str]:
+    """Email из JSON-тела. FastAPI уже прочитал тело, так что повторного чтения сокета нет"""
+    try:
+        data = await request.json()
+    except ValueError:
+        return None
+    email = data.get("email") if isinstance(data, dict) else None
+    return email.strip().lower() if isinstance(email, str) else None
+
+
+async def form_order_id(request: Request) -> Optional[str]:
+    """orderid из формы колбэка. Starlette кэширует форму, обработчик прочитает её повторно без сокета"""
+    order_id = (await request.form()).get("orderid")
+    return order_id.strip() if isinstance(order_id, str) and order_id.strip() else None
+
+
+class RateLimit:
+    """
+    Зависимость FastAPI, ограничивающая частоту запросов.
+
+        @router.post("/login", dependencies=[Depends(RateLimit("login", "10/60"))])
+
+    При превышении лимита отвечает 429 с заголовком Retry-After ещё до вызова обработчика.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        limit: str,
+        key_func: Callable[[Request], Awaitable[Optional[str]]] = client_ip,
+    ):
+        self.name = name
+        self.capacity, self.period = parse_limit(limit)
+        self.key_func = key_func
+
+    async def __call__(self, request: Request):
+        key = await self.key_func(request)
+        if key is None:
+            return
+
+        retry_after = await get_backend().hit(f"{self.name}:{key}", self.capacity, self.period)
+        if retry_after:
+            raise HTTPException(
+                status_code=429,
+                detail="Слишком много запросов, попробуйте позже",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import smtplib
+from email.message import EmailMessage
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import selectinload
+
+from app import models
+from app.config import ADMIN_EMAILS, SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASSWORD, SMTP_FROM
+from app.jobs import job_handler
+
+logger = logging.getLogger(__name__)
+
+
+def build_receipt(order: models.Order) -> EmailMessage:
+    lines = [f"Заказ №{order.id} оплачен.", ""]
+    total = 0
+    for item in order.items:
+        price = item.product.price if item.product else 0
+        total += price * item.quantity
+        lines.append(f"{item.product_name} × {item.quantity} — {price * item.quantity} ₽")
+    lines += ["", f"Итого: {total} ₽"]
+
+    message = EmailMessage()
+    message["Subject"] = f"Чек по заказу №{order.id}"
+    message["From"] = SMTP_FROM
+    message["To"] = order.user.email
+    message.set_content("\n".join(lines))
+    return message
+
+
+def _send(message: EmailMessage):
+    with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30) as smtp:
+        smtp.starttls()
+        if SMTP_USER:
+            smtp.login(SMTP_USER, SMTP_PASSWORD)
+        smtp.send_message(message)
+
+
+@job_handler("send_receipt")
+async def send_receipt(db: AsyncSession, payload: dict):
+    """Отправляет чек покупателю после успешной оплаты"""
+    result = await db.execute(
+        select(models.Order)
+        .options(selectinload(models.Order.items).selectinload(models.OrderItem.product))
+        .where(models.Order.id == payload["order_id"])
+    )
+    order = result.scalar_one_or_none()
+    if order is None or order.user is None:
+        # Гостевой заказ или заказ удалён — отправлять некуда
+        return
+
+    if not SMTP_HOST:
+        logger.warning("SMTP_HOST не задан, чек по заказу %s не отправлен", order.id)
+        return
+
+    await asyncio.to_thread(_send, build_receipt(order))
+
+
+@job_handler("notify_oversold_order")
+async def notify_oversold_order(db: AsyncSession, payload: dict):
+    """Оплачен заказ, для которого товаров уже не хватило (оплата после отмены) — пишем администраторам"""
+    products = ", ".join(payload["products"])
+    logger.warning("Заказ %s оплачен, но товаров не хватает: %s", payload["order_id"], products)
+    if not SMTP_HOST or not ADMIN_EMAILS:
+        return
+
+    message = EmailMessage()
+    message["Subject"] = f"Заказ №{payload['order_id']} оплачен без остатков"
+    message["From"] = SMTP_FROM
+    message["To"] = ", ".join(sorted(ADMIN_EMAILS))
+    message.set_content(
+        f"Оплата по заказу №{payload['order_id']} пришла после его отмены, "
+        f"а товаров на складе уже не хватает: {products}.\n"
+        "Остатки ушли в минус — свяжитесь с покупателем: замена или возврат оплаты."
+    )
+    await asyncio.to_thread(_send, message)
@@ -2,19 +2,35 @@ import os
 from fastapi import APIRouter, Request, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
-from app.models import Order, OrderStatus
+from app.models import Order, OrderArchive, OrderStatus, User
 from sqlalchemy import select
 from fastapi.responses import RedirectResponse, JSONResponse
 from dotenv import load_dotenv
+from app.config import PAYKEEPER_CALLBACK_IPS, RATE_LIMIT_PAYMENT_CALLBACK, RATE_LIMIT_PAYMENT_CALLBACK_ORDER
+from app.rate_limit import RateLimit, client_ip_except, form_order_id
+from app.jobs import enqueue
+from app.order_snapshots import set_snapshot_status, refresh_order_snapshot
+from app.crud import release_order_stock, reserve_order_stock, invalidate_product_caches
+from app.profiling import ProfiledRoute
 
 # Загружаем переменные из .env
 load_dotenv()
 
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
 
-router = APIRouter()
-
-@router.post("/callback")
+router = APIRouter(route_class=ProfiledRoute)
+
+@router.post(
+    "/callback",
+    # Зависимости выполняются по порядку: лимит на адрес срабатывает раньше, чем
+    # произвольные orderid успеют наплодить ключей в лимите на заказ
+    dependencies=[
+        Depends(RateLimit(
+            "payments:callback", RATE_LIMIT_PAYMENT_CALLBACK, key_func=client_ip_except(PAYKEEPER_CALLBACK_IPS)
+        )),
+        Depends(RateLimit("payments:callback:order", RATE_LIMIT_PAYMENT_CALLBACK_ORDER, key_func=form_order_id)),
+    ],
+)
 async def payment_callback(request: Request, db: AsyncSession = Depends(get_db)):
     data = await request.form()
     order_id = data.get("orderid")
@@ -30,14 +46,37 @@ async def payment_callback(request: Request, db: AsyncSession = Depends(get_db))
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
 
+    stock_changed = False
     if status == "success":
-        order.status = OrderStatus.paid
+        # PayKeeper повторяет колбэки — статус и чек меняются только при первом из них
+        if order.status in (OrderStatus.new, OrderStatus.pending, OrderStatus.cancelled):
+            if order.status == OrderStatus.cancelled:
+                # Оплата пришла после отмены: деньги уже списаны, поэтому заказ становится paid,
+                # даже если товаров не хватает — остаток уходит в минус, нехватку разбирает администратор
+                short = await reserve_order_stock(db, order.id, oversell=True)
+                stock_changed = True
+                if short:
+                    enqueue(db, "notify_oversold_order", {"order_id": order.id, "products": short})
+            order.status = OrderStatus.paid
+            # Чек уходит в фоне, в той же транзакции, что и смена статуса
+            enqueue(db, "send_receipt", {"order_id": order.id})
         redirect_url = f"{FRONTEND_URL}/payment/success?order_id={order.id}"
     else:
+        if order.status != OrderStatus.cancelled:
+            stock_changed = True
+            # Неоплаченный заказ возвращает товары на склад в той же транзакции
+            await release_order_stock(db, order.id)
         order.status = OrderStatus.cancelled
         redirect_url = f"{FRONTEND_URL}/payment/fail?order_id={order.id}"
 
+    if order.snapshot is not None:
+        set_snapshot_status(order)
+    else:
+        await refresh_order_snapshot(db, order.id)
+
     await db.commit()
+    if stock_changed:
+        invalidate_product_caches()
     return RedirectResponse(url=redirect_url, status_code=303)
 
 
@@ -46,13 +85,17 @@ async def payment_success(order_id: int, db: AsyncSession = Depends(get_db)):
     stmt = select(Order).where(Order.id == order_id)
     result = await db.execute(stmt)
     order = result.scalar_one_or_none()
+    if not order:
+        # Старые закрытые заказы перенесены в архив
+        order = await db.get(OrderArchive, order_id)
 
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
 
+    user = await db.get(User, order.user_id) if order.user_id else None
     return JSONResponse({
         "order_id": order.id,
-        "email": order.user.email if order.user else None,
+        "email": user.email if user else None,
         "status": order.status,
         "message": "Оплата прошла успешно. Чек отправлен на указанную почту."
     })
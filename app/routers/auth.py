@@ -14,18 +14,34 @@ from app.auth_crud import (
     create_access_token,
     get_current_user,
 )
-from app.config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from app.config import (
+    SECRET_KEY,
+    ALGORITHM,
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    RATE_LIMIT_LOGIN,
+    RATE_LIMIT_LOGIN_EMAIL,
+    RATE_LIMIT_REGISTER,
+)
+from app.rate_limit import RateLimit, body_email
+from app.profiling import ProfiledRoute
 from database import get_db
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 security_scheme = HTTPBearer(auto_error=False)
 
+# Лимиты проверяются до хэширования пароля, чтобы перебор не грузил CPU
+login_limits = [
+    Depends(RateLimit("login:ip", RATE_LIMIT_LOGIN)),
+    Depends(RateLimit("login:email", RATE_LIMIT_LOGIN_EMAIL, key_func=body_email)),
+]
+register_limits = [Depends(RateLimit("register:ip", RATE_LIMIT_REGISTER))]
+
 
 class AuthCheckResponse(BaseModel):
     email: Optional[str]
 
 
-@router.post("/register", response_model=schemas.UserOut)
+@router.post("/register", response_model=schemas.UserOut, dependencies=register_limits)
 async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
     """Регистрация нового пользователя"""
     existing = await get_user_by_email(db, user.email)
@@ -40,7 +56,7 @@ async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_db))
     return new_user
 
 
-@router.post("/login", response_model=schemas.UserOut)
+@router.post("/login", response_model=schemas.UserOut, dependencies=login_limits)
 async def login(user: schemas.UserLogin, response: Response, db: AsyncSession = Depends(get_db)):
     """Авторизация пользователя"""
     db_user = await get_user_by_email(db, user.email)
@@ -1,9 +1,10 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from app import schemas, crud
+from app.profiling import ProfiledRoute
 from database import get_db
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 @router.post("/", response_model=schemas.CategoryOut)
 async def create_category(category: schemas.CategoryCreate, db: AsyncSession = Depends(get_db)):
@@ -11,4 +12,15 @@ async def create_category(category: schemas.CategoryCreate, db: AsyncSession = D
 
 @router.get("/", response_model=list[schemas.CategoryOut])
 async def read_categories(db: AsyncSession = Depends(get_db)):
-    return await crud.get_categories(db)
\ No newline at end of file
+    return await crud.get_categories(db)
+
+@router.get("/tree", response_model=list[schemas.CategoryTreeNode])
+async def read_category_tree(db: AsyncSession = Depends(get_db)):
+    return await crud.get_category_tree(db)
+
+@router.get("/{category_id}/breadcrumbs", response_model=list[schemas.CategoryOut])
+async def read_category_breadcrumbs(category_id: int, db: AsyncSession = Depends(get_db)):
+    breadcrumbs = await crud.get_category_breadcrumbs(db, category_id)
+    if not breadcrumbs:
+        raise HTTPException(status_code=404, detail="Category not found")
+    return breadcrumbs
@@ -0,0 +1,13 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import jobs
+from app.auth_crud import get_admin_user
+from app.profiling import ProfiledRoute
+from database import get_db
+
+router = APIRouter(route_class=ProfiledRoute)
+
+@router.get("/metrics", dependencies=[Depends(get_admin_user)])
+async def read_job_metrics(db: AsyncSession = Depends(get_db)):
+    """Глубина очереди и задержки выполнения фоновых задач"""
+    return await jobs.get_queue_stats(db)
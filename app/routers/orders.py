@@ -2,11 +2,13 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_db
 from typing import List, Optional
+from datetime import datetime
 from app import models, schemas
 import app.crud as crud
 from app.schemas import OrderCreate, OrderRead
+from app.profiling import ProfiledRoute
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 @router.post("/", response_model=OrderRead, status_code=status.HTTP_201_CREATED)
 async def create_order(
@@ -19,12 +21,21 @@ async def create_order(
     return await crud.create_order(db, order_data)
 
 @router.get("/", response_model=List[OrderRead])
-async def read_all_orders(db: AsyncSession = Depends(get_db)):
-    return await crud.get_all_orders(db)
+async def read_all_orders(
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    return await crud.get_all_orders(db, created_from, created_to)
 
 @router.get("/user/{user_id}", response_model=List[OrderRead])
-async def read_orders_by_user(user_id: int, db: AsyncSession = Depends(get_db)):
-    return await crud.get_orders_by_user(db, user_id)
+async def read_orders_by_user(
+    user_id: int,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    return await crud.get_orders_by_user(db, user_id, created_from, created_to)
 
 @router.get("/{order_id}", response_model=OrderRead)
 async def read_order(order_id: int, db: AsyncSession = Depends(get_db)):
@@ -1,21 +1,20 @@
 import os
 import uuid
 import shutil
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from typing import Optional
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Query
 from fastapi.responses import FileResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from app import schemas, crud, models
 from database import get_db
-from dotenv import load_dotenv
+from app.config import PRODUCTS_MEDIA_DIR, SUGGEST_LIMIT
+from app.feeds import schedule_regeneration as schedule_feeds
+from app.search_index import product_names
+from app.media_gc import media_url, remove_media_files, unreferenced_urls
+from app.profiling import ProfiledRoute
 
-# Загружаем .env
-load_dotenv()
+router = APIRouter(route_class=ProfiledRoute)
 
-router = APIRouter()
-
-# Пути из .env
-MEDIA_ROOT = os.getenv("MEDIA_ROOT", "media")
-PRODUCTS_MEDIA_DIR = os.getenv("PRODUCTS_MEDIA_DIR", os.path.join(MEDIA_ROOT, "products"))
 
 # Убедимся, что папка существует
 os.makedirs(PRODUCTS_MEDIA_DIR, exist_ok=True)
@@ -26,8 +25,36 @@ async def create_product(product: schemas.ProductCreate, db: AsyncSession = Depe
 
 
 @router.get("/", response_model=list[schemas.ProductOut])
-async def read_products(db: AsyncSession = Depends(get_db)):
-    return await crud.get_products(db)
+async def read_products(
+    catigory: Optional[int] = None,
+    available: Optional[bool] = None,
+    min_price: Optional[int] = None,
+    max_price: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    return await crud.get_products(
+        db, catigory=catigory, available=available, min_price=min_price, max_price=max_price
+    )
+
+
+@router.get("/suggest", response_model=list[schemas.ProductSuggestion])
+async def suggest_products(q: str, limit: int = Query(SUGGEST_LIMIT, ge=1, le=50)):
+    """Подсказки по началу названия из индекса в памяти, без обращения к БД"""
+    return product_names.suggest(q, limit)
+
+
+@router.get("/facets", response_model=schemas.ProductFacets)
+async def read_product_facets(
+    catigory: Optional[int] = None,
+    available: Optional[bool] = None,
+    min_price: Optional[int] = None,
+    max_price: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Счётчики по категориям, наличию и ценовым диапазонам для текущих фильтров"""
+    return await crud.get_product_facets(
+        db, catigory=catigory, available=available, min_price=min_price, max_price=max_price
+    )
 
 
 @router.get("/{product_id}", response_model=schemas.ProductOut)
@@ -77,13 +104,15 @@ async def upload_product_image(
     with open(file_path, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
 
-    relative_url = f"/{PRODUCTS_MEDIA_DIR}/{filename}".replace("\\", "/")
+    relative_url = media_url(filename)
 
     image = models.ProductImage(
         product_id=product.id,
         image_url=relative_url
     )
     db.add(image)
+    await crud.touch_product(db, product.id)
+    await schedule_feeds(db)
     await db.commit()
     await db.refresh(image)
 
@@ -96,14 +125,14 @@ async def delete_product_image(image_id: int, db: AsyncSession = Depends(get_db)
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
 
-    file_path = os.path.join(os.getcwd(), image.image_url.lstrip("/"))
-
-    if os.path.exists(file_path):
-        os.remove(file_path)
-
     await db.delete(image)
+    await crud.touch_product(db, image.product_id)
+    await schedule_feeds(db)
     await db.commit()
 
+    # Файл удаляем после коммита: при ошибке БД строка не останется без файла
+    remove_media_files(await unreferenced_urls(db, [image.image_url]))
+
     return {"detail": "Image deleted"}
 
 
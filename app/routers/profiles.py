@@ -0,0 +1,25 @@
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Query
+from app import profiling
+from app.auth_crud import get_admin_user
+from app.config import PROFILE_HEADER, PROFILE_MAX_REPORTS
+from app.profiling import ProfiledRoute
+
+router = APIRouter(route_class=ProfiledRoute, dependencies=[Depends(get_admin_user)])
+
+@router.get("/")
+async def read_profiles(limit: int = Query(50, ge=1, le=PROFILE_MAX_REPORTS)):
+    """Последние отчёты профилировщика, новые первыми"""
+    return await asyncio.to_thread(profiling.list_reports, limit)
+
+@router.post("/token")
+async def create_profile_token(ttl: int = Query(600, ge=1, le=24 * 60 * 60)):
+    """Подписанный заголовок, включающий профилирование запроса"""
+    return {"header": PROFILE_HEADER, "value": profiling.sign_token(ttl)}
+
+@router.get("/{report_id}")
+async def read_profile(report_id: str):
+    report = await asyncio.to_thread(profiling.load_report, report_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Report not found")
+    return report
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr, field_validator, Field
+from pydantic import BaseModel, EmailStr, field_validator, model_validator, Field
 from typing import Optional, List
 from datetime import datetime
 import enum
@@ -8,6 +8,7 @@ import enum
 class CategoryBase(BaseModel):
     name: str
     tittle: str
+    parent_id: Optional[int] = None
 
 
 class CategoryCreate(CategoryBase):
@@ -21,6 +22,12 @@ class CategoryOut(CategoryBase):
         from_attributes = True
 
 
+class CategoryTreeNode(CategoryOut):
+    # Товары во всём поддереве категории
+    product_count: int = 0
+    children: List["CategoryTreeNode"] = []
+
+
 # Product
 class ProductBase(BaseModel):
     catigory: int
@@ -61,6 +68,34 @@ class ProductOut(ProductBase):
     class Config:
         from_attributes = True
 
+class ProductSuggestion(BaseModel):
+    id: int
+    name: str
+    available: bool
+
+
+class CategoryFacet(BaseModel):
+    id: Optional[int]
+    count: int
+
+
+class AvailabilityFacet(BaseModel):
+    available: bool
+    count: int
+
+
+class PriceRangeFacet(BaseModel):
+    min: Optional[int]
+    max: Optional[int]
+    count: int
+
+
+class ProductFacets(BaseModel):
+    total: int
+    categories: List[CategoryFacet] = []
+    available: List[AvailabilityFacet] = []
+    price_ranges: List[PriceRangeFacet] = []
+
 # Orders
 class OrderStatus(str, enum.Enum):
     new = "new"
@@ -82,11 +117,30 @@ class OrderCreate(BaseModel):
     status: Optional[OrderStatus] = OrderStatus.new
 
 
+class OrderProductRead(BaseModel):
+    """Товар в позиции на момент заказа. Остатков нет: они меняются уже после заказа"""
+    id: int
+    name: str
+    price: Optional[int] = 0
+    image_url: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+    @model_validator(mode="before")
+    @classmethod
+    def first_image(cls, data):
+        # Без основной картинки берём первую из галереи
+        if not isinstance(data, dict) and data.image_url is None and data.images:
+            return {"id": data.id, "name": data.name, "price": data.price, "image_url": data.images[0].image_url}
+        return data
+
+
 class OrderItemRead(BaseModel):
     id: int
     product_name: str
     quantity: int
-    product: Optional["ProductOut"]
+    product: Optional[OrderProductRead]
 
     class Config:
         from_attributes = True
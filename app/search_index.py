@@ -0,0 +1,129 @@
+"""
+Индекс названий товаров в памяти для подсказок при наборе (/products/suggest).
+
+Ключи — нормализованные хвосты названия, начиная с каждого слова ("красные розы",
+"розы"), лежат в отсортированном списке; поиск по префиксу — bisect и короткий
+проход вперёд. Индекс строится при старте одним потоковым запросом, правится
+в create/update/delete_product и периодически пересобирается целиком.
+"""
+import asyncio
+import logging
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.future import select
+
+from app.config import SUGGEST_LIMIT, SUGGEST_REBUILD_INTERVAL
+from app.models import Product
+from database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 64
+# Сколько совпадений просматривается для ранжирования
+SCAN_LIMIT = 200
+
+
+def normalize(value: str) -> str:
+    return " ".join(value.casefold().replace("ё", "е").split())
+
+
+def _keys(name: str) -> List[str]:
+    words = normalize(name).split(" ")
+    return [" ".join(words[i:])[:MAX_KEY_LENGTH] for i in range(len(words)) if words[i]]
+
+
+class ProductNameIndex:
+    def __init__(self):
+        self._keys: List[Tuple[str, int]] = []
+        # id -> (название, в наличии, нормализованное название)
+        self._products: Dict[int, Tuple[str, bool, str]] = {}
+
+    def __len__(self):
+        return len(self._products)
+
+    def upsert(self, product_id: int, name: str, available: bool):
+        if product_id in self._products:
+            self.remove(product_id)
+        self._products[product_id] = (name, available, normalize(name))
+        for key in _keys(name):
+            insort(self._keys, (key, product_id))
+
+    def remove(self, product_id: int):
+        product = self._products.pop(product_id, None)
+        if product is None:
+            return
+        for key in _keys(product[0]):
+            index = bisect_left(self._keys, (key, product_id))
+            if index < len(self._keys) and self._keys[index] == (key, product_id):
+                del self._keys[index]
+
+    def suggest(self, query: str, limit: int = SUGGEST_LIMIT) -> List[dict]:
+        prefix = normalize(query)[:MAX_KEY_LENGTH]
+        if not prefix:
+            return []
+
+        # Для каждого товара запоминаем, совпало ли начало названия, а не только слово внутри
+        matches: Dict[int, bool] = {}
+        index = bisect_left(self._keys, (prefix,))
+        while index < len(self._keys) and len(matches) < SCAN_LIMIT:
+            key, product_id = self._keys[index]
+            if not key.startswith(prefix):
+                break
+            matches[product_id] = matches.get(product_id, False) or self._products[product_id][2].startswith(prefix)
+            index += 1
+
+        ranked = sorted(
+            matches.items(),
+            key=lambda item: (
+                not self._products[item[0]][1],  # сначала в наличии
+                not item[1],                     # затем совпадение с начала названия
+                len(self._products[item[0]][0]),
+                self._products[item[0]][0],
+            ),
+        )
+        return [
+            {"id": product_id, "name": self._products[product_id][0], "available": self._products[product_id][1]}
+            for product_id, _ in ranked[:limit]
+        ]
+
+    async def build(self):
+        """Пересобирает индекс целиком и подменяет его одним присваиванием"""
+        keys: List[Tuple[str, int]] = []
+        products: Dict[int, Tuple[str, bool, str]] = {}
+
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(
+                select(Product.id, Product.name, Product.available).execution_options(yield_per=5000)
+            )
+            async for product_id, name, available in result:
+                products[product_id] = (name, available, normalize(name))
+                keys.extend((key, product_id) for key in _keys(name))
+
+        keys.sort()
+        self._keys, self._products = keys, products
+
+
+product_names = ProductNameIndex()
+
+_refresher: Optional[asyncio.Task] = None
+
+
+async def _refresh_periodically():
+    while True:
+        await asyncio.sleep(SUGGEST_REBUILD_INTERVAL)
+        try:
+            await product_names.build()
+        except Exception:
+            logger.exception("Не удалось пересобрать индекс подсказок")
+
+
+async def start():
+    global _refresher
+    await product_names.build()
+    _refresher = asyncio.create_task(_refresh_periodically())
+
+
+async def stop():
+    if _refresher is not None:
+        _refresher.cancel()
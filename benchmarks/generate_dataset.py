@@ -0,0 +1,278 @@
+"""
+Синтетические данные для проверки на объёмах прода.
+
+Генерирует категории, товары, картинки, пользователей, заказы и позиции
+детерминированно от --seed и заливает их через COPY (asyncpg). Повторный запуск
+добавляет строки поверх существующих: id продолжаются с текущего максимума.
+
+    python -m benchmarks.generate_dataset --products 200000 --users 1000000 --orders 5000000
+
+Распределения:
+  * популярность товаров — Zipf (s = --skew): небольшая часть каталога даёт большую часть позиций;
+  * позиций в заказе — в основном 1–3, с длинным хвостом крупных (B2B) заказов;
+  * заказы растут к текущей дате, старые в основном completed/cancelled, свежие —
+    new/pending/paid/processing; все статусы OrderStatus встречаются;
+  * около 15% заказов гостевые (user_id = NULL), а часть пользователей заказывает намного чаще.
+
+order_items ссылается на products.name, available вычисляет сама база. Если orders
+секционирована, недостающие секции создаются до загрузки. Снимки заказов
+(orders.snapshot) собираются здесь же, без отдельной пересборки.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from app.auth_crud import get_password_hash
+from app.models import OrderStatus
+from app.partitioning import add_months, create_partitions, is_partitioned
+from database import engine
+
+BATCH_SIZE = 50_000
+PASSWORD = "Password#1"
+
+ADJECTIVES = ["Красные", "Белые", "Розовые", "Жёлтые", "Нежные", "Яркие", "Пионовидные", "Кустовые", "Садовые", "Свадебные"]
+NOUNS = ["розы", "тюльпаны", "пионы", "хризантемы", "лилии", "орхидеи", "гортензии", "ромашки", "ирисы", "эустомы"]
+ROOT_CATEGORIES = ["Цветы", "Букеты", "Композиции", "Растения в горшках", "Подарки", "Открытки"]
+
+
+class Loader:
+    def __init__(self, conn, raw):
+        self.conn = conn
+        self.raw = raw
+
+    async def max_id(self, table: str) -> int:
+        return (await self.conn.execute(text(f"SELECT coalesce(max(id), 0) FROM {table}"))).scalar()
+
+    async def copy(self, table: str, columns, records):
+        if records:
+            await self.raw.copy_records_to_table(table, records=records, columns=columns)
+
+    async def reset_sequence(self, table: str):
+        await self.conn.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT coalesce(max(id), 1) FROM {table}))"
+        ))
+
+
+async def generate_categories(loader: Loader, rnd: random.Random, count: int):
+    start = await loader.max_id("catigories") + 1
+    categories, closure = [], []
+    roots = []
+    for category_id in range(start, start + count):
+        # Первые категории — корни, остальные раскладываются по ним
+        if len(roots) < len(ROOT_CATEGORIES) and category_id - start < len(ROOT_CATEGORIES):
+            title = ROOT_CATEGORIES[category_id - start]
+            parent = None
+            roots.append(category_id)
+        else:
+            parent = rnd.choice(roots)
+            title = f"{rnd.choice(ADJECTIVES)} {rnd.choice(NOUNS)}"
+        categories.append((category_id, f"category-{category_id}", title, parent))
+        closure.append((category_id, category_id, 0))
+        if parent is not None:
+            closure.append((parent, category_id, 1))
+
+    await loader.copy("catigories", ["id", "name", "tittle", "parent_id"], categories)
+    await loader.copy("category_closure", ["ancestor_id", "descendant_id", "depth"], closure)
+    await loader.reset_sequence("catigories")
+
+
+async def generate_products(loader: Loader, rnd: random.Random, count: int):
+    category_ids = (await loader.conn.execute(text("SELECT id FROM catigories"))).scalars().all()
+    if not category_ids:
+        raise SystemExit("Нет категорий: запустите с --categories N")
+
+    start = await loader.max_id("products") + 1
+    image_id = await loader.max_id("product_images") + 1
+    products, images = [], []
+
+    for product_id in range(start, start + count):
+        price = int(round(rnd.lognormvariate(7.6, 0.6), -1))
+        amount = 0 if rnd.random() < 0.2 else rnd.randint(1, 500)
+        products.append((
+            product_id,
+            rnd.choice(category_ids),
+            f"{rnd.choice(ADJECTIVES)} {rnd.choice(NOUNS)} №{product_id}",
+            price,
+            amount,
+            f"Описание товара №{product_id}",
+        ))
+        for _ in range(min(int(rnd.expovariate(0.6)), 6)):
+            images.append((image_id, product_id, f"/media/products/synthetic-{image_id}.jpg"))
+            image_id += 1
+
+        if len(products) >= BATCH_SIZE:
+            await loader.copy("products", ["id", "catigory", "name", "price", "amount", "description"], products)
+            await loader.copy("product_images", ["id", "product_id", "image_url"], images)
+            products, images = [], []
+
+    await loader.copy("products", ["id", "catigory", "name", "price", "amount", "description"], products)
+    await loader.copy("product_images", ["id", "product_id", "image_url"], images)
+    await loader.reset_sequence("products")
+    await loader.reset_sequence("product_images")
+
+
+async def generate_users(loader: Loader, count: int):
+    start = await loader.max_id("users") + 1
+    # bcrypt дорогой — у всех синтетических пользователей один хэш
+    password = get_password_hash(PASSWORD)
+    for batch_start in range(start, start + count, BATCH_SIZE):
+        batch_end = min(batch_start + BATCH_SIZE, start + count)
+        await loader.copy(
+            "users", ["id", "email", "password"],
+            [(user_id, f"user{user_id}@example.com", password) for user_id in range(batch_start, batch_end)],
+        )
+    await loader.reset_sequence("users")
+
+
+async def _load_catalog(loader: Loader, with_snapshots: bool):
+    """Товары в порядке id: [(name, товар для снимка | None)] — как OrderProductRead"""
+    if not with_snapshots:
+        names = (await loader.conn.execute(text("SELECT name FROM products ORDER BY id"))).scalars().all()
+        return [(name, None) for name in names]
+
+    # Без основной картинки — первая из галереи
+    result = await loader.conn.execute(text(
+        """SELECT p.id, p.name, p.price, coalesce(p.image_url, (
+               SELECT i.image_url FROM product_images i WHERE i.product_id = p.id ORDER BY i.id LIMIT 1
+           ))
+           FROM products p ORDER BY p.id"""
+    ))
+    return [
+        (name, {"id": product_id, "name": name, "price": price, "image_url": image_url})
+        for product_id, name, price, image_url in result.all()
+    ]
+
+
+def _zipf_cum_weights(rnd: random.Random, count: int, skew: float):
+    """Накопленные веса Zipf по случайной перестановке товаров"""
+    ranks = list(range(1, count + 1))
+    rnd.shuffle(ranks)
+    return list(itertools.accumulate(1 / rank ** skew for rank in ranks))
+
+
+def _status_for(age_days: float, rnd: random.Random) -> OrderStatus:
+    if age_days > 14:
+        return OrderStatus.completed if rnd.random() < 0.85 else OrderStatus.cancelled
+    return rnd.choices(list(OrderStatus), weights=[15, 15, 20, 20, 20, 10])[0]
+
+
+async def generate_orders(loader: Loader, rnd: random.Random, count: int, months: int, skew: float, with_snapshots: bool):
+    catalog = await _load_catalog(loader, with_snapshots)
+    if not catalog:
+        raise SystemExit("Нет товаров: запустите с --products N")
+    max_user = await loader.max_id("users")
+
+    product_weights = _zipf_cum_weights(rnd, len(catalog), skew)
+    total_weight = product_weights[-1]
+    # Часть пользователей заказывает намного чаще остальных
+    user_weights = list(itertools.accumulate(1 / rank ** 0.8 for rank in range(1, max_user + 1))) if max_user else []
+
+    now = datetime.now().replace(microsecond=0)
+    history = timedelta(days=30 * months)
+    first_month = (now - history).date().replace(day=1)
+    if await is_partitioned(loader.conn):
+        await create_partitions(loader.conn, first_month, add_months(now.date(), 3))
+
+    order_id = await loader.max_id("orders") + 1
+    item_id = await loader.max_id("order_items") + 1
+    orders, items = [], []
+
+    for _ in range(count):
+        # Заказов больше ближе к текущей дате
+        created_at = now - history * (1 - rnd.random() ** 0.6)
+        age_days = (now - created_at).total_seconds() / 86400
+        status = _status_for(age_days, rnd)
+        user_id = None
+        if user_weights and rnd.random() > 0.15:
+            user_id = bisect_left(user_weights, rnd.random() * user_weights[-1]) + 1
+
+        item_count = 1 + min(int(rnd.paretovariate(1.6)) - 1 + int(rnd.expovariate(1.0)), 49)
+        chosen = {}
+        for _ in range(item_count):
+            index = bisect_left(product_weights, rnd.random() * total_weight)
+            chosen[index] = chosen.get(index, 0) + (1 if rnd.random() < 0.7 else rnd.randint(2, 10))
+
+        snapshot_items = []
+        for index, quantity in chosen.items():
+            name, product = catalog[index]
+            items.append((item_id, order_id, created_at, name, quantity))
+            if with_snapshots:
+                snapshot_items.append({"id": item_id, "product_name": name, "quantity": quantity, "product": product})
+            item_id += 1
+
+        snapshot = None
+        if with_snapshots:
+            snapshot = json.dumps({
+                "id": order_id, "user_id": user_id, "created_at": created_at.isoformat(),
+                "status": status.value, "items": snapshot_items,
+            }, ensure_ascii=False)
+        orders.append((order_id, user_id, created_at, status.value, snapshot))
+        order_id += 1
+
+        if len(orders) >= BATCH_SIZE:
+            await _copy_orders(loader, orders, items)
+            orders, items = [], []
+
+    await _copy_orders(loader, orders, items)
+    await loader.reset_sequence("orders")
+    await loader.reset_sequence("order_items")
+
+
+async def _copy_orders(loader: Loader, orders, items):
+    await loader.copy("orders", ["id", "user_id", "created_at", "status", "snapshot"], orders)
+    await loader.copy("order_items", ["id", "order_id", "order_created_at", "product_name", "quantity"], items)
+
+
+async def main(args):
+    started = time.perf_counter()
+    async with engine.connect() as conn:
+        raw = (await conn.get_raw_connection()).driver_connection
+        loader = Loader(conn, raw)
+
+        # У каждой таблицы свой поток случайных чисел, зависящий от сида и стартового id:
+        # повторный прогон на той же базе даёт те же строки, дозаливка — новые
+        async def step(name, table, coro_factory):
+            if not getattr(args, name):
+                return
+            step_started = time.perf_counter()
+            rnd = random.Random(f"{args.seed}:{table}:{await loader.max_id(table)}")
+            await coro_factory(rnd)
+            await conn.commit()
+            print(f"{table}: +{getattr(args, name)} за {time.perf_counter() - step_started:.1f} c")
+
+        await step("categories", "catigories", lambda rnd: generate_categories(loader, rnd, args.categories))
+        await step("products", "products", lambda rnd: generate_products(loader, rnd, args.products))
+        await step("users", "users", lambda rnd: generate_users(loader, args.users))
+        await step("orders", "orders", lambda rnd: generate_orders(
+            loader, rnd, args.orders, args.months, args.skew, not args.no_snapshots
+        ))
+
+        await conn.execute(text("ANALYZE"))
+        await conn.commit()
+
+    await engine.dispose()
+    print(f"Готово за {time.perf_counter() - started:.1f} c")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Генератор синтетических данных магазина")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--categories", type=int, default=0)
+    parser.add_argument("--products", type=int, default=0)
+    parser.add_argument("--users", type=int, default=0)
+    parser.add_argument("--orders", type=int, default=0)
+    parser.add_argument("--months", type=int, default=24, help="глубина истории заказов")
+    parser.add_argument("--skew", type=float, default=1.1, help="показатель Zipf для популярности товаров")
+    parser.add_argument("--no-snapshots", action="store_true", help="не заполнять orders.snapshot")
+    args = parser.parse_args()
+
+    if not any((args.categories, args.products, args.users, args.orders)):
+        parser.error("укажите хотя бы одно из --categories/--products/--users/--orders")
+    asyncio.run(main(args))
@@ -0,0 +1,256 @@
+"""
+Нагрузочный прогон витрины и оформления заказа.
+
+Приложение запускается в этом же процессе (ASGI без сети) против локального
+Postgres из DATABASE_URL. Смесь запросов задаётся весами:
+
+    products   GET  /products/
+    categories GET  /categories/
+    login      POST /auth/login
+    order      POST /orders/             (гостевой заказ)
+    callback   POST /payments/callback   (по заказам, созданным в прогоне)
+
+Логин идёт отдельным клиентом: его cookie не попадает в остальные запросы.
+Создание платежа в PayKeeper (crud.create_payment) не покрыто — его не вызывает ни один маршрут.
+
+Для каждого маршрута выводятся пропускная способность, p50/p95/p99, доля ошибок и число
+SQL-запросов на запрос. Код выхода 1 при любой ошибке в прогоне, а с --baseline — ещё
+и при регрессии относительно сохранённого результата.
+
+    python -m benchmarks.load_test --duration 30 --concurrency 20
+    python -m benchmarks.load_test --save-baseline benchmarks/baseline.json
+    python -m benchmarks.load_test --baseline benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+BENCH_EMAIL = "loadtest@example.com"
+BENCH_PASSWORD = "LoadTest#2024"
+BENCH_PRODUCTS = 50
+
+DEFAULT_MIX = "products=40,categories=20,login=10,order=20,callback=10"
+
+# Счётчик SQL-запросов текущего HTTP-запроса
+_queries = contextvars.ContextVar("queries", default=None)
+
+
+def configure_env():
+    """Переменные окружения нужно выставить до импорта приложения"""
+    os.environ.setdefault("DB_ECHO", "0")
+    # Лимитер иначе отвечал бы 429 на поток логинов с одного адреса
+    for name in (
+        "RATE_LIMIT_LOGIN", "RATE_LIMIT_LOGIN_EMAIL", "RATE_LIMIT_REGISTER",
+        "RATE_LIMIT_PAYMENT_CALLBACK", "RATE_LIMIT_PAYMENT_CALLBACK_ORDER",
+    ):
+        os.environ[name] = "1000000000/1"
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def prepare(client):
+    """Пользователь и товары для прогона; повторный запуск использует существующие"""
+    await client.post("/auth/register", json={"email": BENCH_EMAIL, "password": BENCH_PASSWORD})
+
+    response = await client.get("/categories/")
+    categories = response.json()
+    if categories:
+        category_id = categories[0]["id"]
+    else:
+        response = await client.post("/categories/", json={"name": "bench", "tittle": "Bench"})
+        category_id = response.json()["id"]
+
+    names = []
+    for i in range(BENCH_PRODUCTS):
+        name = f"bench-product-{i}"
+        await client.post("/products/", json={
+            "catigory": category_id, "name": name, "price": 100 + i, "amount": 1_000_000_000,
+        })
+        names.append(name)
+    return names
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    def summary(self, duration):
+        result = {}
+        for route, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            count = len(latencies)
+            result[route] = {
+                "requests": count,
+                "errors": self.errors[route],
+                "error_rate": self.errors[route] / count if count else 0,
+                "rps": count / duration,
+                "p50_ms": percentile(latencies, 0.50) * 1000,
+                "p95_ms": percentile(latencies, 0.95) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+                "queries_per_request": self.queries[route] / count if count else 0,
+            }
+        return result
+
+
+async def run(args):
+    configure_env()
+
+    import httpx
+    from sqlalchemy import event
+
+    from database import engine
+    from main import app
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        counter = _queries.get()
+        if counter is not None:
+            counter[0] += 1
+
+    mix = []
+    for part in args.mix.split(","):
+        route, _, weight = part.partition("=")
+        mix.append((route.strip(), int(weight)))
+    routes = [route for route, _ in mix]
+    weights = [weight for _, weight in mix]
+
+    stats = Stats()
+    order_ids = []
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as setup_client:
+            products = await prepare(setup_client)
+
+        async def call(client, auth_client, route, rnd):
+            if route == "products":
+                return await client.get("/products/")
+            if route == "categories":
+                return await client.get("/categories/")
+            if route == "login":
+                return await auth_client.post("/auth/login", json={"email": BENCH_EMAIL, "password": BENCH_PASSWORD})
+            if route == "order":
+                items = [
+                    {"product_name": name, "quantity": rnd.randint(1, 3)}
+                    for name in rnd.sample(products, rnd.randint(1, 4))
+                ]
+                response = await client.post("/orders/", json={"items": items})
+                if response.status_code == 201:
+                    order_ids.append(response.json()["id"])
+                return response
+            if route == "callback":
+                if not order_ids:
+                    return None
+                return await client.post("/payments/callback", data={
+                    "orderid": str(rnd.choice(order_ids)), "status": "success",
+                })
+            raise ValueError(f"Неизвестный маршрут в смеси: {route}")
+
+        async def user(seed, deadline):
+            rnd = random.Random(seed)
+            # Отдельный клиент для логина, чтобы его cookie не меняла остальные сценарии
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client, \
+                    httpx.AsyncClient(transport=transport, base_url="http://bench") as auth_client:
+                while time.perf_counter() < deadline:
+                    route = rnd.choices(routes, weights)[0]
+                    counter = [0]
+                    token = _queries.set(counter)
+                    started = time.perf_counter()
+                    try:
+                        response = await call(client, auth_client, route, rnd)
+                    finally:
+                        _queries.reset(token)
+                    if response is None:
+                        continue
+                    stats.latencies[route].append(time.perf_counter() - started)
+                    stats.queries[route] += counter[0]
+                    if response.status_code >= 400:
+                        stats.errors[route] += 1
+
+        # Прогрев: соединения пула, кэши, индекс подсказок
+        await asyncio.gather(*(user(args.seed + 1000 + i, time.perf_counter() + args.warmup)
+                               for i in range(args.concurrency)))
+        stats = Stats()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user(args.seed + i, started + args.duration) for i in range(args.concurrency)))
+        duration = time.perf_counter() - started
+
+    await engine.dispose()
+    return stats.summary(duration)
+
+
+def print_summary(summary, baseline=None, tolerance=0.0):
+    header = f"{'route':<12} {'req':>7} {'err':>5} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'q/req':>6}"
+    print(header)
+    print("-" * len(header))
+    regressions = []
+    for route, row in summary.items():
+        print(
+            f"{route:<12} {row['requests']:>7} {row['errors']:>5} {row['rps']:>8.1f} "
+            f"{row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['queries_per_request']:>6.1f}"
+        )
+        if row["errors"]:
+            regressions.append(f"{route}: ошибок {row['errors']} из {row['requests']}")
+        base = (baseline or {}).get(route)
+        if not base:
+            continue
+        if row["error_rate"] > base.get("error_rate", 0):
+            regressions.append(
+                f"{route}: доля ошибок {base.get('error_rate', 0):.2%} -> {row['error_rate']:.2%}"
+            )
+        if row["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{route}: p95 {base['p95_ms']:.2f} -> {row['p95_ms']:.2f} ms")
+        if row["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{route}: rps {base['rps']:.1f} -> {row['rps']:.1f}")
+        # Число запросов к БД не зависит от шума — любое увеличение считается регрессией
+        if row["queries_per_request"] > base["queries_per_request"] + 0.05:
+            regressions.append(
+                f"{route}: SQL на запрос {base['queries_per_request']:.1f} -> {row['queries_per_request']:.1f}"
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон API магазина")
+    parser.add_argument("--duration", type=float, default=30, help="секунд измерения")
+    parser.add_argument("--warmup", type=float, default=5, help="секунд прогрева")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", help="JSON с прошлым результатом для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="допустимое ухудшение p95/rps")
+    parser.add_argument("--save-baseline", help="сохранить результат как базовый")
+    args = parser.parse_args()
+
+    summary = asyncio.run(run(args))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    regressions = print_summary(summary, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        print(f"\nБазовый результат сохранён в {args.save_baseline}")
+
+    if regressions:
+        print("\nРегрессии:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
@@ -0,0 +1,186 @@
+"""
+Задержка поиска заказа в секционированной orders по мере роста истории.
+
+Во временной схеме bench_orders создаётся копия orders с помесячными секциями,
+которая наполняется шагами до указанных размеров. На каждом шаге меряются:
+
+  * by id           — как в колбэке PayKeeper (только id, проверяются все секции);
+  * by id + month   — id с датой заказа (остаётся одна секция);
+  * user + month    — заказы пользователя за месяц (фильтр по дате из /orders/user/{id}).
+
+    python -m benchmarks.order_lookup --sizes 1000000,10000000,30000000
+
+--live-months N имитирует команду archive: после наполнения всё старше N месяцев
+(считаем, что старые заказы уже закрыты) переносится в архивную таблицу, а пустые
+секции удаляются — так выглядит прод, где закрытые заказы регулярно архивируются.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.partitioning import add_months
+from database import DATABASE_URL
+
+SCHEMA = "bench_orders"
+START = date(2015, 1, 1)
+
+
+async def create_schema(conn):
+    await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+    await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    await conn.execute(text(
+        f"""CREATE TABLE {SCHEMA}.orders (
+                id BIGINT NOT NULL,
+                user_id INTEGER,
+                created_at TIMESTAMP NOT NULL,
+                status TEXT NOT NULL,
+                snapshot JSONB,
+                PRIMARY KEY (id, created_at)
+            ) PARTITION BY RANGE (created_at)"""
+    ))
+    await conn.execute(text(f"CREATE TABLE {SCHEMA}.orders_archive (LIKE {SCHEMA}.orders)"))
+
+
+async def fill(conn, start_id: int, end_id: int, rows_per_month: int, users: int) -> date:
+    """Добавляет заказы с id в [start_id, end_id), по rows_per_month на месяц"""
+    first_month = add_months(START, (start_id - 1) // rows_per_month)
+    last_month = add_months(START, (end_id - 2) // rows_per_month)
+
+    month = first_month
+    while month <= last_month:
+        upper = add_months(month, 1)
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {SCHEMA}.orders_p{month:%Y%m} PARTITION OF {SCHEMA}.orders "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{upper.isoformat()}')"
+        ))
+        month = upper
+
+    await conn.execute(text(
+        f"""INSERT INTO {SCHEMA}.orders (id, user_id, created_at, status, snapshot)
+            SELECT g,
+                   1 + (g * 7919) % :users,
+                   CAST(:start AS DATE) + make_interval(months => ((g - 1) / :per_month)::int)
+                       + make_interval(secs => ((g - 1) % :per_month) * 2592000.0 / :per_month),
+                   (ARRAY['new','pending','paid','processing','completed','cancelled'])[1 + g % 6],
+                   jsonb_build_object('id', g)
+            FROM generate_series(CAST(:first AS BIGINT), CAST(:last AS BIGINT)) AS g"""
+    ), {"users": users, "start": START, "per_month": rows_per_month, "first": start_id, "last": end_id - 1})
+
+    await conn.execute(text(f"CREATE INDEX IF NOT EXISTS orders_id_idx ON {SCHEMA}.orders (id)"))
+    await conn.execute(text(
+        f"CREATE INDEX IF NOT EXISTS orders_user_idx ON {SCHEMA}.orders (user_id, created_at)"
+    ))
+    return last_month
+
+
+async def archive(conn, keep_from: date):
+    await conn.execute(text(
+        f"""WITH moved AS (
+                DELETE FROM {SCHEMA}.orders
+                WHERE created_at < :keep_from
+                RETURNING *
+            )
+            INSERT INTO {SCHEMA}.orders_archive SELECT * FROM moved"""
+    ), {"keep_from": keep_from})
+
+    result = await conn.execute(text(
+        f"""SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = '{SCHEMA}.orders'::regclass"""
+    ))
+    for name in result.scalars().all():
+        month = date(int(name[-6:-2]), int(name[-2:]), 1)
+        if month >= keep_from:
+            continue
+        empty = await conn.execute(text(f"SELECT NOT EXISTS (SELECT 1 FROM {SCHEMA}.{name})"))
+        if empty.scalar():
+            await conn.execute(text(f"DROP TABLE {SCHEMA}.{name}"))
+
+
+async def measure(conn, stmt: str, params_list) -> tuple:
+    timings = []
+    query = text(stmt)
+    for params in params_list:
+        started = time.perf_counter()
+        await conn.execute(query, params)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.99) - 1]
+
+
+async def run(sizes, rows_per_month: int, users: int, lookups: int, live_months: int, keep: bool):
+    engine = create_async_engine(DATABASE_URL)
+    rnd = random.Random(42)
+
+    async with engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await create_schema(conn)
+
+        print(f"{'rows':>12} {'parts':>6} {'by id p50/p99':>16} {'id+month p50/p99':>18} {'user+month p50/p99':>20}")
+        filled = 1
+        for size in sizes:
+            last_month = await fill(conn, filled, size + 1, rows_per_month, users)
+            filled = size + 1
+            if live_months:
+                await archive(conn, add_months(last_month, -live_months))
+            await conn.execute(text(f"ANALYZE {SCHEMA}.orders"))
+
+            result = await conn.execute(text(
+                f"SELECT count(*) FROM pg_inherits WHERE inhparent = '{SCHEMA}.orders'::regclass"
+            ))
+            partitions = result.scalar()
+
+            # Ищем заказы последних месяцев — их и запрашивают колбэки
+            recent = max(1, size - rows_per_month * 2)
+            ids = [rnd.randint(recent, size) for _ in range(lookups)]
+            month = add_months(last_month, -1)
+
+            by_id = await measure(
+                conn, f"SELECT snapshot FROM {SCHEMA}.orders WHERE id = :id",
+                [{"id": i} for i in ids],
+            )
+            by_id_month = await measure(
+                conn,
+                f"SELECT snapshot FROM {SCHEMA}.orders "
+                f"WHERE id = :id AND created_at >= :month AND created_at < :upper",
+                [{"id": i, "month": month, "upper": add_months(month, 2)} for i in ids],
+            )
+            by_user = await measure(
+                conn,
+                f"SELECT snapshot FROM {SCHEMA}.orders "
+                f"WHERE user_id = :user AND created_at >= :month AND created_at < :upper",
+                [{"user": rnd.randint(1, users), "month": month, "upper": add_months(month, 1)}
+                 for _ in range(lookups)],
+            )
+
+            print(
+                f"{size:>12} {partitions:>6} "
+                f"{by_id[0]:>7.3f}/{by_id[1]:<8.3f} {by_id_month[0]:>8.3f}/{by_id_month[1]:<9.3f} "
+                f"{by_user[0]:>9.3f}/{by_user[1]:<9.3f}"
+            )
+
+        if not keep:
+            await conn.execute(text(f"DROP SCHEMA {SCHEMA} CASCADE"))
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Задержка поиска заказов в секционированной таблице")
+    parser.add_argument("--sizes", default="1000000,5000000,10000000,30000000")
+    parser.add_argument("--rows-per-month", type=int, default=250_000)
+    parser.add_argument("--users", type=int, default=200_000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--live-months", type=int, default=12)
+    parser.add_argument("--keep", action="store_true", help="не удалять схему после прогона")
+    args = parser.parse_args()
+
+    asyncio.run(run(
+        [int(size) for size in args.sizes.split(",")],
+        args.rows_per_month, args.users, args.lookups, args.live_months, args.keep,
+    ))
@@ -1,11 +1,28 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import os
 
-from app.routers import categories, products, orders, auth, PayKeeper
+from app.routers import categories, products, orders, auth, PayKeeper, jobs as jobs_router, profiles
+from app.profiling import ProfilingMiddleware
+from app import jobs, receipts, order_snapshots, partitioning, feeds, search_index, media_gc  # noqa: F401 — модули регистрируют обработчики задач
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await partitioning.schedule_maintenance()
+    await feeds.schedule_if_missing()
+    await media_gc.schedule_sweeper()
+    await jobs.schedule_purge()
+    await search_index.start()
+    jobs.start_workers()
+    yield
+    await jobs.stop_workers()
+    await search_index.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://127.0.0.1:5173",
@@ -21,7 +38,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Profile-Id"],
 )
+app.add_middleware(ProfilingMiddleware)
 
 app.mount("/media", StaticFiles(directory="media"), name="media")
 app.include_router(categories.router, prefix="/categories", tags=["categories"])
@@ -29,6 +48,8 @@ app.include_router(products.router, prefix="/products", tags=["products"])
 app.include_router(orders.router, prefix="/orders", tags=["orders"])
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(PayKeeper.router, prefix="/payments", tags=["payments"])
+app.include_router(jobs_router.router, prefix="/jobs", tags=["jobs"])
+app.include_router(profiles.router, prefix="/profiles", tags=["profiles"])
 
 MEDIA_DIR = os.path.join(os.getcwd(), "media")
 if not os.path.exists(MEDIA_DIR):